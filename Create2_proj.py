@@ -64,6 +64,7 @@ TEXTHEIGHT = 24
 VELOCITYCHANGE = 200
 ROTATIONCHANGE = 300
 DOCK_TIMEOUT = 30  # Timeout for docking in seconds
+DRIVE_PERIOD = 0.05  # Seconds between drive commands, key autorepeat is coalesced
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -85,6 +86,7 @@ class TetheredDriveApp(tk.Tk):
         self.title("iRobot Create 2 Tethered Drive")
 
         self.robot = None
+        self.drive = None
         self.velocity = 0
         self.rotation = 0
         # custom variables
@@ -170,8 +172,8 @@ class TetheredDriveApp(tk.Tk):
 
         vr = int(self.velocity + (self.rotation / 2))
         vl = int(self.velocity - (self.rotation / 2))
-        if self.robot:
-            self.robot.drive_direct(vl, vr)
+        if self.drive:
+            self.drive.drive_direct(vl, vr)
 
     def _format_sensor_data(self, sensors):
         """
@@ -193,6 +195,7 @@ class TetheredDriveApp(tk.Tk):
             port = simpledialog.askstring('Port?', 'Enter COM port to open.\nAvailable options:\n' + '\n'.join(ports))
             if port:
                 self.robot = cl.Create2(port=port, baud=115200)
+                self.drive = cl.DriveScheduler(self.robot, period=DRIVE_PERIOD)
                 messagebox.showinfo('Connected', "Connection succeeded!")
                 logging.info(f"Connected to robot on {port}")
         except Exception as e:
@@ -210,6 +213,10 @@ class TetheredDriveApp(tk.Tk):
         Handles quitting the application.
         """
         if messagebox.askyesno('Really?', 'Are you sure you want to quit?'):
+            if self.drive:
+                self.drive.stop()
+                logging.info(f"Drive commands: {self.drive.stats()}")
+                self.drive = None
             if self.robot:
                 del self.robot
             self.destroy()
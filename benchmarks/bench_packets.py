@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# Microbenchmark: packet 100 decoding
+#
+#   python benchmarks/bench_packets.py [-n NUMBER]
+#
+# Compares the single pass SensorPacketDecoder against the field-by-field
+# reference decoder it replaced.
+##############################################
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from createlib.packets import SensorPacketDecoder, _reference_sensor_packet_decoder
+
+
+def random_packet(seed=0):
+    rng = random.Random(seed)
+    return bytes(rng.randrange(256) for _ in range(80))
+
+
+def bench(func, data, number, repeat=5):
+    """
+    return: best time per call in seconds
+    """
+    return min(timeit.repeat(lambda: func(data), number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Packet 100 decoding microbenchmark')
+    parser.add_argument('-n', '--number', type=int, default=20000, help='calls per timing run')
+    args = parser.parse_args()
+
+    data = random_packet()
+    assert SensorPacketDecoder(data) == _reference_sensor_packet_decoder(data)
+
+    ref = bench(_reference_sensor_packet_decoder, data, args.number)
+    fast = bench(SensorPacketDecoder, data, args.number)
+
+    print(f"reference decoder: {ref * 1e6:8.2f} us/frame  {1 / ref:10.0f} frames/s")
+    print(f"single pass:       {fast * 1e6:8.2f} us/frame  {1 / fast:10.0f} frames/s")
+    print(f"speedup:           {ref / fast:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
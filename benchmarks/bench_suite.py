@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# Benchmark suite for the createlib hot paths
+#
+#   python benchmarks/bench_suite.py [--transport loopback|pty] [--json out.json] [--compare old.json]
+#
+# Reports:
+#   - frames decoded per second (packet 100, from bytes and parsed and decoded in place from a ReceiveBuffer)
+#   - commands encoded per second (SerialCommandInterface.write, Create2.drive_direct, batches)
+#   - memory blocks a decoded frame holds (tracemalloc) and the peak bytes of one decode
+#   - command to reply latency percentiles against the simulated robot
+#
+# Results are saved as JSON (--json) so runs can be compared (--compare).
+##############################################
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from createlib.create_oi import OPCODES, SENSOR_PACKETS
+from createlib.create_robot import Create2
+from createlib.create_serial import SerialCommandInterface, ReceiveBuffer
+from createlib.packets import SensorPacketDecoder
+from createlib.sensor_stream import StreamFrameParser
+from createlib.simulator import LoopbackTransport, PtySimulator
+
+
+class NullTransport(object):
+    """ Swallows writes, for measuring encoding cost only """
+
+    port = 'null'
+    baudrate = 115200
+    timeout = 0
+    is_open = True
+    in_waiting = 0
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def read(self, size=1):
+        return b''
+
+    def flushInput(self):
+        pass
+
+
+def random_packet(seed=0):
+    rng = random.Random(seed)
+    return bytes(rng.randrange(256) for _ in range(80))
+
+
+def stream_frame(payload):
+    frame = bytearray((19, 81, 100)) + payload
+    frame.append(-sum(frame) & 0xFF)
+    return bytes(frame)
+
+
+def rate(func, seconds):
+    """
+    Calls func() repeatedly for about `seconds`, returns calls per second
+    """
+    calls = 0
+    batch = 100
+    start = time.perf_counter()
+    while True:
+        for _ in range(batch):
+            func()
+        calls += batch
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return calls / elapsed
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+
+    def pct(p):
+        return samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+
+    return {
+        'p50_us': pct(50) * 1e6,
+        'p90_us': pct(90) * 1e6,
+        'p99_us': pct(99) * 1e6,
+        'max_us': samples[-1] * 1e6,
+        'samples': len(samples),
+    }
+
+
+class _QuietCreate2(Create2):
+    """ Create2 without the shutdown sequence (and its sleeps) on exit """
+
+    def __del__(self):
+        pass
+
+
+# ------------------------ Benchmarks ----------------------------
+
+def bench_decode(seconds):
+    data = random_packet()
+    frames = stream_frame(data) * 40
+    rx = ReceiveBuffer(len(frames) + 64)
+    parser = StreamFrameParser()
+
+    def parse_and_decode():
+        rx.clear()
+        rx.extend(frames)
+        while True:
+            offset = parser.parse(rx)
+            if offset < 0:
+                break
+            SensorPacketDecoder(rx.buf, offset)
+
+    return {
+        'decode_frames_per_s': rate(lambda: SensorPacketDecoder(data), seconds),
+        'stream_frames_per_s': 40 * rate(parse_and_decode, seconds),
+    }
+
+
+def _blocks(snapshot):
+    return sum(stat.count for stat in snapshot.statistics('filename'))
+
+
+def bench_allocations(frames=10000):
+    """
+    Memory blocks the decoded results hold on to, per frame, decoding from
+    bytes and in place on the stream path, counted with tracemalloc (the
+    results go in a list allocated up front, so only the decoder's blocks
+    count). Also the peak bytes a single decode allocates, with nothing kept.
+    """
+    import tracemalloc
+
+    data = random_packet()
+    keep = [None] * frames
+    frame = stream_frame(data)
+    rx = ReceiveBuffer(4096)
+    parser = StreamFrameParser()
+
+    tracemalloc.start()
+    try:
+        before = _blocks(tracemalloc.take_snapshot())
+        for i in range(frames):
+            keep[i] = SensorPacketDecoder(data)
+        decode_blocks = (_blocks(tracemalloc.take_snapshot()) - before) / frames
+        keep[:] = [None] * frames
+
+        before = _blocks(tracemalloc.take_snapshot())
+        for i in range(frames):
+            rx.extend(frame)
+            keep[i] = SensorPacketDecoder(rx.buf, parser.parse(rx))
+        stream_blocks = (_blocks(tracemalloc.take_snapshot()) - before) / frames
+        keep[:] = [None] * frames
+
+        SensorPacketDecoder(data)
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        SensorPacketDecoder(data)
+        peak_bytes = tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'decode_retained_blocks_per_frame': decode_blocks,
+        'stream_retained_blocks_per_frame': stream_blocks,
+        'decode_peak_bytes': peak_bytes,
+    }
+
+
+def bench_encode(seconds):
+    sci = SerialCommandInterface(NullTransport())
+    robot = _QuietCreate2('null', transport=NullTransport())
+
+    def batched():
+        with sci.batch():
+            for _ in range(10):
+                sci.write(OPCODES.DRIVE_DIRECT, (0, 100, 0, 100))
+
+    return {
+        'sci_write_per_s': rate(lambda: sci.write(OPCODES.DRIVE_DIRECT, (0, 100, 0, 100)), seconds),
+        'drive_direct_per_s': rate(lambda: robot.drive_direct(100, -100), seconds),
+        'batched_write_per_s': 10 * rate(batched, seconds),
+    }
+
+
+def bench_latency(transport, samples):
+    if transport == 'pty':
+        sim = PtySimulator()
+        robot = _QuietCreate2(sim.port)
+    else:
+        sim = None
+        robot = _QuietCreate2('sim', transport=LoopbackTransport())
+
+    try:
+        robot.start()
+        robot.SCI.write(OPCODES.SAFE)
+
+        query = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            robot.query(SENSOR_PACKETS.OI_MODE)
+            query.append(time.perf_counter() - start)
+
+        sensors = []
+        for _ in range(max(samples // 10, 10)):
+            start = time.perf_counter()
+            robot.get_sensors()
+            sensors.append(time.perf_counter() - start)
+
+        stream = robot.start_stream()
+        arrivals = []
+        stream.add_raw_listener(lambda buf, offset, ts: arrivals.append(ts))
+        time.sleep(0.5)
+        robot.stop_stream()
+        periods = [(b - a) / 1e9 for a, b in zip(arrivals, arrivals[1:])]
+    finally:
+        robot.close()
+        if sim is not None:
+            sim.close()
+
+    return {
+        'transport': transport,
+        'query_oi_mode': percentiles(query),
+        'get_sensors': percentiles(sensors),
+        'stream_period': percentiles(periods) if periods else None,
+    }
+
+
+# ------------------------ Reporting ----------------------------
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def report(results, baseline=None):
+    flat = flatten(results)
+    old = flatten(baseline) if baseline else {}
+    width = max(len(k) for k in flat)
+    for key, value in flat.items():
+        line = f"{key:<{width}}  {value:14.2f}"
+        if key in old and old[key]:
+            line += f"  ({value / old[key]:6.2f}x baseline)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='createlib benchmark suite')
+    parser.add_argument('--transport', choices=['loopback', 'pty'], default='loopback',
+                        help='simulated robot used for the latency benchmarks')
+    parser.add_argument('--seconds', type=float, default=1.0, help='time spent on each throughput benchmark')
+    parser.add_argument('--samples', type=int, default=500, help='round trips per latency benchmark')
+    parser.add_argument('--json', help='save the results to this file')
+    parser.add_argument('--compare', help='a previous --json file to compare against')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = {
+        'decode': bench_decode(args.seconds),
+        'allocations': bench_allocations(),
+        'encode': bench_encode(args.seconds),
+        'latency': bench_latency(args.transport, args.samples),
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    report(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
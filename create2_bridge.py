@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# Serves a Create 2 to control stations over the network, see createlib.bridge
+#
+#   python create2_bridge.py /dev/ttyUSB0 [--host 127.0.0.1] [--port 8023]
+#   python create2_bridge.py --simulate
+##############################################
+
+from createlib.bridge import main
+
+if __name__ == '__main__':
+    main()
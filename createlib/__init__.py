@@ -1,4 +1,4 @@
-__all__ = ['create_oi', 'repeat_timer', 'create_serial', 'packets','create_robot']
+__all__ = ['create_oi', 'repeat_timer', 'scheduler', 'create_serial', 'packets','create_robot', 'sensor_stream', 'create_async', 'drive_scheduler', 'odometry', 'telemetry', 'columnar', 'simulator', 'fleet', 'events', 'reflex', 'metrics', 'motion', 'pursuit', 'mapping', 'bridge']
 
 # deprecated to keep older scripts who import this from breaking
 from createlib.create_oi import BAUD_RATE, DAYS ,DRIVE,MOTORS, LEDS,\
@@ -8,7 +8,23 @@ from createlib.create_oi import BAUD_RATE, DAYS ,DRIVE,MOTORS, LEDS,\
 from createlib.packets import decode,\
                        BumpsAndWheelDrop, WheelOvercurrents, Buttons,\
                        ChargingSources,LightBumper ,Stasis, Sensors,\
-                       SensorPacketDecoder
+                       SensorPacketDecoder, SensorQuery, sensor_query,\
+                       SensorSnapshot
 from createlib.repeat_timer import RepeatTimer
-from createlib.create_serial import SerialCommandInterface
-from createlib.create_robot import Create2
\ No newline at end of file
+from createlib.scheduler import PeriodicScheduler, PeriodicJob
+from createlib.create_serial import SerialCommandInterface, ReceiveBuffer
+from createlib.sensor_stream import SensorStream, StreamFrameParser
+from createlib.events import SensorEvents, Subscription
+from createlib.reflex import Reflexes, Reflex
+from createlib.metrics import Histogram, Metrics
+from createlib.create_robot import Create2
+from createlib.create_async import AsyncCreate2
+from createlib.drive_scheduler import DriveScheduler
+from createlib.odometry import Odometry, Pose
+from createlib.motion import MotionController, Motion
+from createlib.pursuit import PurePursuit
+from createlib.mapping import OccupancyGrid, OccupancyMapper
+from createlib.telemetry import TelemetryRecorder, TelemetryReader
+from createlib.simulator import SimulatedCreate2, LoopbackTransport, PtySimulator
+from createlib.fleet import Fleet
+from createlib.bridge import Bridge, BridgeClient
@@ -0,0 +1,528 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# Network bridge: one Create2, many control stations
+#
+# The bridge owns the robot's serial port. Clients send commands over TCP
+# and every command, from every client, is executed in order by the bridge
+# thread, so clients never fight over SCI.lock. Sensor frames go out over
+# UDP: the stream reader only swaps in the latest frame, and a sender
+# thread sends it to every subscriber that is due (a subscriber with
+# decimation n gets every nth frame). A subscriber that cannot keep up
+# gets the latest frame, never a backlog.
+#
+# TCP messages (big endian):
+#   request: B kind, B sequence, H payload length, payload
+#   reply:   B kind, B sequence, B status (0 ok, 1 error), H payload length, payload
+#            (the payload of an error is its message, utf-8)
+#   kinds:   see MESSAGES
+#
+# UDP datagram: B version, I frame number, Q time.monotonic_ns() on the
+# bridge, then the 80 bytes of packet 100 (decode with SensorPacketDecoder)
+#
+# When a client that drove the robot disconnects, the robot is stopped.
+#
+#   bridge = Bridge(Create2('/dev/ttyUSB0'), port=8023)
+#   bridge.start()
+#
+#   client = BridgeClient('robot.local', 8023)
+#   client.command(OPCODES.SAFE)
+#   client.drive_direct(200, 200)
+#   client.subscribe(decimation=4)   # every 4th frame, 60 ms
+#   frame, timestamp, sensors = client.receive()
+#
+# or as a process (--simulate runs a simulated robot on a pty):
+#   python create2_bridge.py /dev/ttyUSB0 --port 8023
+#
+# NOTE: there is no authentication, anyone who can reach the port can drive
+# the robot. The bridge listens on localhost unless told otherwise.
+##############################################
+
+import argparse
+import logging
+import selectors
+import socket
+import threading
+import time
+from enum import IntEnum
+from struct import Struct
+from createlib.create_oi import OPCODES, COMMAND_ARGUMENTS, VARIABLE_COMMANDS
+from createlib.packets import SensorPacketDecoder
+
+REQUEST = Struct('>BBH')    # kind, sequence, payload length
+REPLY = Struct('>BBBH')     # kind, sequence, status, payload length
+FRAME = Struct('>BIQ')      # version, frame number, timestamp ns
+DRIVE = Struct('>hh')       # left, right mm/sec
+SUBSCRIBE = Struct('>HH')   # UDP port, decimation
+FRAME_VERSION = 1
+PAYLOAD_LEN = 80
+MAX_PAYLOAD = 1024
+OK, ERROR = 0, 1
+DEFAULT_PORT = 8023
+
+
+class MESSAGES(IntEnum):
+    """TCP request kinds, the reply has the same kind."""
+    PING = 0         # the reply echoes the payload
+    COMMAND = 1      # payload: an Open Interface command, [opcode][data ...]
+    DRIVE = 2        # payload: DRIVE, same as DRIVE_DIRECT but left first
+    STOP = 3         # DRIVE_DIRECT 0, 0
+    SUBSCRIBE = 4    # payload: SUBSCRIBE, frames go to the client's address at that port
+    UNSUBSCRIBE = 5
+    LATEST = 6       # reply: the latest frame, as in a datagram
+
+
+# the bridge's sensor stream owns these, a client using them would break it
+# for every other client (STOP and RESET turn the Open Interface, and so the stream, off)
+_RESERVED = {OPCODES.BAUD, OPCODES.SENSORS, OPCODES.QUERY_LIST, OPCODES.STREAM, OPCODES.PAUSE_RESUME_STREAM,
+             OPCODES.STOP, OPCODES.RESET}
+# commands that move the wheels, the client sending them is stopped for on disconnect
+_MOTION = {OPCODES.DRIVE, OPCODES.DRIVE_DIRECT, OPCODES.DRIVE_PWM}
+
+
+class _Client(object):
+    __slots__ = ('sock', 'address', 'rx')
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.rx = bytearray()
+
+
+class _Subscriber(object):
+    __slots__ = ('address', 'decimation', 'next_frame', 'sent')
+
+    def __init__(self, address, decimation, next_frame):
+        self.address = address
+        self.decimation = decimation
+        self.next_frame = next_frame
+        self.sent = 0
+
+
+class Bridge(object):
+    """
+    Serves one Create2 to TCP clients and streams its sensors to UDP subscribers.
+    """
+
+    def __init__(self, robot, host='127.0.0.1', port=DEFAULT_PORT, send_timeout=1.0):
+        """
+        robot: the Create2, start() puts it in passive mode and starts its sensor stream
+        host, port: TCP address to listen on (port 0 picks a free one, see address)
+        send_timeout: seconds a reply may block on a client before it is dropped
+        """
+        self.robot = robot
+        self.send_timeout = send_timeout
+        self.clients = {}
+        self.subscribers = {}  # _Client -> _Subscriber
+        self.frames = 0
+        self.datagrams = 0
+        self.skipped = 0       # frames replaced by a newer one before the sender got to them
+        self.commands = 0
+        self.errors = 0
+        self._driver = None    # client that last moved the wheels
+        self._latest = None
+        self._cond = threading.Condition()
+        self._running = False
+        self._threads = []
+
+        self._listener = socket.create_server((host, port))
+        self._listener.setblocking(False)
+        self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+
+    @property
+    def address(self):
+        return self._listener.getsockname()[:2]
+
+    # ------------------------ Life cycle ----------------------------
+
+    def start(self):
+        """
+        Starts the robot (passive mode) and its sensor stream, the command
+        thread and the UDP sender
+        """
+        if self._running:
+            return
+        if not self.robot.streaming and not self.robot.start():
+            raise Exception('The robot did not enter the Open Interface')
+        self._running = True
+        self.robot.start_stream().add_raw_listener(self)
+        self._threads = [threading.Thread(target=self._serve, name="create2-bridge", daemon=True),
+                         threading.Thread(target=self._send, name="create2-bridge-udp", daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        logging.info(f"Bridge listening on {self.address[0]}:{self.address[1]}")
+
+    def stop(self):
+        """
+        Stops serving, the robot stays open and its stream keeps running
+        """
+        if not self._running:
+            return
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=1)
+        self._threads = []
+        if self.robot.stream is not None:
+            self.robot.stream.remove_raw_listener(self)
+
+    def close(self):
+        """
+        Stops serving and closes every socket, the robot stays open
+        """
+        self.stop()
+        for client in list(self.clients.values()):
+            self._drop(client)
+        self._selector.close()
+        self._listener.close()
+        self._udp.close()
+
+    def stats(self):
+        return {
+            'clients': len(self.clients),
+            'subscribers': len(self.subscribers),
+            'frames': self.frames,
+            'datagrams': self.datagrams,
+            'skipped': self.skipped,
+            'commands': self.commands,
+            'errors': self.errors,
+        }
+
+    # ------------------------ Sensor frames ----------------------------
+
+    def __call__(self, buf, offset, timestamp):
+        """
+        One frame, the signature matches SensorStream.add_raw_listener()
+        """
+        datagram = FRAME.pack(FRAME_VERSION, self.frames & 0xFFFFFFFF, timestamp) + bytes(buf[offset:offset + PAYLOAD_LEN])
+        with self._cond:
+            self._latest = datagram
+            self.frames += 1
+            self._cond.notify()
+
+    def _send(self):
+        sent = 0
+        while self._running:
+            with self._cond:
+                self._cond.wait_for(lambda: self.frames != sent or not self._running, 0.1)
+                if self.frames == sent:
+                    continue
+                if self.frames - sent > 1 and sent:
+                    self.skipped += self.frames - sent - 1
+                sent = self.frames
+                datagram = self._latest
+            frame = sent - 1
+
+            for subscriber in list(self.subscribers.values()):
+                if frame < subscriber.next_frame:
+                    continue
+                subscriber.next_frame = frame + subscriber.decimation
+                try:
+                    self._udp.sendto(datagram, subscriber.address)
+                except OSError as e:
+                    logging.debug(f"Bridge could not send a frame to {subscriber.address}: {e}")
+                    continue
+                subscriber.sent += 1
+                self.datagrams += 1
+
+    # ------------------------ Commands ----------------------------
+
+    def _serve(self):
+        while self._running:
+            for key, _ in self._selector.select(timeout=0.1):
+                if key.fileobj is self._listener:
+                    self._accept()
+                    continue
+                client = key.data
+                try:
+                    data = client.sock.recv(4096)
+                except OSError:
+                    data = b''
+                if not data:
+                    self._drop(client)
+                    continue
+                client.rx += data
+                self._process(client)
+
+    def _accept(self):
+        try:
+            sock, address = self._listener.accept()
+        except BlockingIOError:
+            return
+        # replies go out right away instead of waiting to be coalesced
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.send_timeout)
+        client = _Client(sock, address)
+        self.clients[sock.fileno()] = client
+        self._selector.register(sock, selectors.EVENT_READ, client)
+        logging.info(f"Bridge client {address[0]}:{address[1]} connected")
+
+    def _drop(self, client):
+        if self.clients.pop(client.sock.fileno(), None) is None:
+            return
+        self.subscribers.pop(client, None)
+        try:
+            self._selector.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
+        logging.info(f"Bridge client {client.address[0]}:{client.address[1]} disconnected")
+        if client is self._driver:
+            self._driver = None
+            try:
+                self.robot.drive_direct(0, 0)
+            except Exception as e:
+                logging.error(f"Bridge could not stop the robot after its driver left: {e}")
+
+    def _process(self, client):
+        rx = client.rx
+        while len(rx) >= REQUEST.size:
+            kind, sequence, length = REQUEST.unpack_from(rx)
+            if length > MAX_PAYLOAD:
+                logging.error(f"Bridge client {client.address[0]} sent a {length} byte payload, dropping it")
+                self._drop(client)
+                return
+            end = REQUEST.size + length
+            if len(rx) < end:
+                return
+            payload = bytes(rx[REQUEST.size:end])
+            del rx[:end]
+
+            try:
+                reply = self._execute(client, kind, payload) or b''
+                status = OK
+            except Exception as e:
+                reply = str(e).encode()[:MAX_PAYLOAD]
+                status = ERROR
+                self.errors += 1
+            self.commands += 1
+            try:
+                client.sock.sendall(REPLY.pack(kind, sequence, status, len(reply)) + reply)
+            except OSError:
+                self._drop(client)
+                return
+
+    def _execute(self, client, kind, payload):
+        robot = self.robot
+        if kind == MESSAGES.PING:
+            return payload
+
+        if kind == MESSAGES.COMMAND:
+            if not payload:
+                raise Exception('COMMAND needs an opcode')
+            try:
+                opcode = OPCODES(payload[0])
+            except ValueError:
+                raise Exception(f"Unknown opcode {payload[0]}")
+            if opcode in _RESERVED:
+                raise Exception(f"{opcode.name} is reserved for the bridge's sensor stream")
+            data = payload[1:]
+            expected = _data_length(opcode, data)
+            if len(data) != expected:
+                # a short or long command would shift every later byte on the port
+                raise Exception(f"{opcode.name} takes {expected} data bytes, not {len(data)}")
+            robot.SCI.write(opcode, tuple(data) or None)
+            if opcode in _MOTION:
+                self._driver = client
+
+        elif kind == MESSAGES.DRIVE:
+            left, right = DRIVE.unpack(payload)
+            robot.drive_direct(left, right)
+            self._driver = client
+
+        elif kind == MESSAGES.STOP:
+            robot.drive_direct(0, 0)
+
+        elif kind == MESSAGES.SUBSCRIBE:
+            port, decimation = SUBSCRIBE.unpack(payload)
+            self.subscribers[client] = _Subscriber((client.address[0], port), max(decimation, 1), self.frames)
+
+        elif kind == MESSAGES.UNSUBSCRIBE:
+            self.subscribers.pop(client, None)
+
+        elif kind == MESSAGES.LATEST:
+            if self._latest is None:
+                raise Exception('No sensor frame yet')
+            return self._latest
+
+        else:
+            raise Exception(f"Unknown message kind {kind}")
+
+
+class BridgeClient(object):
+    """
+    A control station's end of a Bridge
+    """
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, timeout=1.0):
+        """
+        timeout: seconds to wait for a reply or a frame
+        """
+        self.timeout = timeout
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.udp = None
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.sock.close()
+        if self.udp is not None:
+            self.udp.close()
+            self.udp = None
+
+    def _recv_exactly(self, n):
+        buf = bytearray()
+        while len(buf) < n:
+            data = self.sock.recv(n - len(buf))
+            if not data:
+                raise Exception('The bridge closed the connection')
+            buf += data
+        return bytes(buf)
+
+    def request(self, kind, payload=b''):
+        """
+        Sends one request and waits for its reply.
+
+        return: the reply's payload, raises an Exception with the bridge's
+                message if the request failed
+        """
+        with self._lock:
+            self._sequence = (self._sequence + 1) & 0xFF
+            self.sock.sendall(REQUEST.pack(kind, self._sequence, len(payload)) + payload)
+            reply_kind, sequence, status, length = REPLY.unpack(self._recv_exactly(REPLY.size))
+            reply = self._recv_exactly(length) if length else b''
+        if (reply_kind, sequence) != (kind, self._sequence):
+            raise Exception(f"Reply {reply_kind}/{sequence} does not match request {kind}/{self._sequence}")
+        if status != OK:
+            raise Exception(reply.decode(errors='replace'))
+        return reply
+
+    def ping(self):
+        """
+        return: the round trip time in seconds
+        """
+        start = time.perf_counter()
+        self.request(MESSAGES.PING)
+        return time.perf_counter() - start
+
+    def command(self, opcode, data=None):
+        """
+        Sends an Open Interface command, like SerialCommandInterface.write()
+        """
+        self.request(MESSAGES.COMMAND, bytes([opcode]) + bytes(data or ()))
+
+    def drive_direct(self, l_vel, r_vel):
+        """
+        Drive motors directly: [-500, 500] mm/sec
+        """
+        self.request(MESSAGES.DRIVE, DRIVE.pack(max(-500, min(500, int(l_vel))), max(-500, min(500, int(r_vel)))))
+
+    def drive_stop(self):
+        self.request(MESSAGES.STOP)
+
+    def latest(self):
+        """
+        The bridge's latest frame over TCP.
+
+        return: (frame number, timestamp ns, Sensors)
+        """
+        return _decode_frame(self.request(MESSAGES.LATEST))
+
+    def subscribe(self, decimation=1, port=0):
+        """
+        Starts receiving every decimation-th frame over UDP, see receive()
+
+        port: local UDP port, 0 picks a free one
+        """
+        if self.udp is None:
+            self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp.bind((self.sock.getsockname()[0], port))
+        self.request(MESSAGES.SUBSCRIBE, SUBSCRIBE.pack(self.udp.getsockname()[1], decimation))
+
+    def unsubscribe(self):
+        self.request(MESSAGES.UNSUBSCRIBE)
+
+    def receive(self, timeout=None):
+        """
+        Waits for a frame and returns the newest one received, older ones
+        still waiting in the socket are dropped.
+
+        return: (frame number, timestamp ns, Sensors), or None on timeout
+        """
+        if self.udp is None:
+            raise Exception('receive() needs subscribe() first')
+        self.udp.settimeout(self.timeout if timeout is None else timeout)
+        try:
+            datagram = self.udp.recv(FRAME.size + PAYLOAD_LEN)
+        except socket.timeout:
+            return None
+        self.udp.setblocking(False)
+        try:
+            while True:
+                datagram = self.udp.recv(FRAME.size + PAYLOAD_LEN)
+        except BlockingIOError:
+            pass
+        return _decode_frame(datagram)
+
+
+def _data_length(opcode, data):
+    """
+    The number of data bytes the robot reads after opcode, given the data sent
+    """
+    if opcode in VARIABLE_COMMANDS:
+        before, per_item = VARIABLE_COMMANDS[opcode]
+        if len(data) < before:
+            return before
+        return before + data[before - 1] * per_item
+    return COMMAND_ARGUMENTS[opcode]
+
+
+def _decode_frame(datagram):
+    version, frame, timestamp = FRAME.unpack_from(datagram)
+    if version != FRAME_VERSION or len(datagram) != FRAME.size + PAYLOAD_LEN:
+        raise Exception(f"Unsupported bridge frame: version {version}, {len(datagram)} bytes")
+    return frame, timestamp, SensorPacketDecoder(datagram[FRAME.size:])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a Create 2 over TCP (commands) and UDP (sensors)')
+    parser.add_argument('serial', nargs='?', help='serial port of the robot')
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on, there is no authentication so only use '
+                             '0.0.0.0 on a trusted network')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='TCP port to listen on')
+    parser.add_argument('--simulate', action='store_true', help='serve a simulated robot instead')
+    args = parser.parse_args(argv)
+
+    from createlib.create_robot import Create2
+    simulator = None
+    if args.simulate:
+        from createlib.simulator import PtySimulator
+        simulator = PtySimulator()
+        args.serial = simulator.port
+    elif not args.serial:
+        parser.error('a serial port is needed, or --simulate')
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    robot = Create2(args.serial, args.baud)
+    bridge = Bridge(robot, args.host, args.port)
+    bridge.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bridge.close()
+        robot.stop_stream()
+        robot.drive_direct(0, 0)
+        robot.close()
+        if simulator is not None:
+            simulator.close()
@@ -0,0 +1,99 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# Columnar (NumPy) views of packet 100 frames
+#
+# A structured dtype mirrors the packet 100 layout (big endian shorts,
+# bitfield bytes as uint8), so a buffer of frames becomes an array with
+# np.frombuffer and no per-frame Python work. to_columns() then turns it
+# into native endian column arrays, with every bitfield byte expanded into
+# one bool column per bit via np.unpackbits.
+#
+# NumPy is optional, it is only needed by this module:
+#   pip install numpy
+##############################################
+
+from createlib.packets import PACKET_100, PACKET_100_LAYOUT, BITFIELD_MASKS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# struct format -> numpy type
+_NUMPY_TYPES = {
+    '?': '?',
+    'B': 'u1',
+    'b': 'i1',
+    'H': '>u2',
+    'h': '>i2',
+}
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('NumPy is required for columnar exports, install it with: pip install numpy')
+
+
+def sensor_dtype(timestamp=False):
+    """
+    Structured dtype of one packet 100 frame, field names match Sensors.
+
+    timestamp: the layout of a telemetry record instead, a little endian
+               int64 'timestamp' (ns) followed by the frame
+    """
+    _require_numpy()
+    base = 8 if timestamp else 0
+    names = [name for name, _, _ in PACKET_100_LAYOUT]
+    formats = [_NUMPY_TYPES[fmt] for _, _, fmt in PACKET_100_LAYOUT]
+    offsets = [base + offset for _, offset, _ in PACKET_100_LAYOUT]
+    if timestamp:
+        names.insert(0, 'timestamp')
+        formats.insert(0, '<i8')
+        offsets.insert(0, 0)
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                     'itemsize': base + PACKET_100.size})
+
+
+def packets_to_array(data):
+    """
+    Structured array over back to back 80 byte packet 100 frames. This is
+    a view of data, nothing is copied.
+    """
+    _require_numpy()
+    return np.frombuffer(data, dtype=sensor_dtype())
+
+
+def telemetry_to_array(reader):
+    """
+    Structured array (with a 'timestamp' field) over every frame of a
+    TelemetryReader, a view of its memory map.
+    """
+    _require_numpy()
+    from createlib.telemetry import HEADER
+    return np.frombuffer(reader._mm, dtype=sensor_dtype(timestamp=True),
+                         count=len(reader), offset=HEADER.size)
+
+
+def to_columns(array):
+    """
+    Dict of native endian column arrays from a structured frame array.
+
+    Bitfields are expanded into bool columns named '<field>.<bit name>',
+    ie, 'bumps_wheeldrops.bump_left'. The raw byte is kept under its own
+    field name.
+    """
+    _require_numpy()
+    columns = {}
+    for name in array.dtype.names:
+        column = array[name]
+        columns[name] = column.astype(column.dtype.newbyteorder('='))
+        masks = BITFIELD_MASKS.get(name)
+        if masks is not None:
+            # unpackbits is most significant bit first, bit b is column 7 - b
+            bits = np.unpackbits(columns[name][:, None], axis=1).view(bool)
+            for field, mask in masks.items():
+                columns[f"{name}.{field}"] = bits[:, 8 - mask.bit_length()]
+    return columns
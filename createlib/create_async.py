@@ -0,0 +1,520 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# asyncio version of the serial interface and the Create2 class
+#
+# pyserial only configures the port, the bytes are moved by asyncio pipe
+# transports over the serial file descriptor. That way one event loop can
+# drive many robots without a thread (or a time.sleep) per robot.
+#
+# NOTE: this needs a selector event loop on a POSIX system, Windows COM
+#       ports do not have a file descriptor asyncio can watch.
+##############################################
+
+import asyncio
+import logging
+import os
+import struct
+from collections import deque
+import serial
+from createlib.packets import SensorPacketDecoder, sensor_query
+from createlib.create_oi import OPCODES, SENSOR_PACKETS, MODES
+from createlib.create_serial import ReceiveBuffer
+from createlib.sensor_stream import StreamFrameParser
+
+
+class SerialProtocol(asyncio.Protocol):
+    """
+    Buffers the bytes coming from the robot. Outside of streaming they are
+    handed to AsyncSerialCommandInterface.read(), while streaming they are
+    parsed as packet 100 frames and pushed to the frame subscribers.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.streaming = False
+        self.latest = None
+        self.frames = 0
+        self.rx = ReceiveBuffer()
+        self.parser = StreamFrameParser()
+        self.subscribers = []
+        self._waiter = None
+
+    @property
+    def bad_frames(self):
+        return self.parser.bad_frames
+
+    @property
+    def dropped_frames(self):
+        return self.parser.dropped_frames
+
+    def connection_lost(self, exc):
+        self.streaming = False
+        self._wake()
+        for queue in self.subscribers:
+            queue.event.set()
+
+    def data_received(self, data):
+        if self.streaming:
+            self._parse_frames(data)
+        else:
+            self.buffer += data
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def wait_for_data(self):
+        self._waiter = asyncio.get_running_loop().create_future()
+        try:
+            await self._waiter
+        finally:
+            self._waiter = None
+
+    def _parse_frames(self, data):
+        rx = self.rx
+        data = memoryview(data)
+        while data:
+            free = rx.writable()
+            n = min(len(free), len(data))
+            free[:n] = data[:n]
+            rx.commit(n)
+            data = data[n:]
+
+            while True:
+                offset = self.parser.parse(rx)
+                if offset < 0:
+                    break
+                sensors = SensorPacketDecoder(rx.buf, offset)
+                self.latest = sensors
+                self.frames += 1
+                for queue in self.subscribers:
+                    queue.append(sensors)
+                    queue.event.set()
+
+
+class _FrameQueue(deque):
+    """ Bounded queue of frames for one subscriber, oldest frames are dropped """
+
+    def __init__(self, maxlen):
+        super().__init__(maxlen=maxlen)
+        self.event = asyncio.Event()
+
+
+class AsyncSerialCommandInterface(object):
+    """
+    asyncio counterpart of SerialCommandInterface.
+    """
+
+    def __init__(self):
+        self.ser = serial.Serial()
+        self.lock = asyncio.Lock()
+        self.protocol = None
+        self._reader = None
+        self._writer = None
+
+    async def open(self, port, baud=115200, timeout=1):
+        """
+        Opens a serial port to the create.
+
+        port: the serial port to open, ie, '/dev/ttyUSB0'
+        buad: default is 115200, but can be changed to a lower rate via the create api
+        timeout: seconds read() waits for a complete reply
+        """
+        self.ser.port = port
+        self.ser.baudrate = baud
+        self.ser.timeout = 0
+        self.timeout = timeout
+
+        if self.ser.is_open:
+            self.ser.close()
+
+        try:
+            self.ser.open()
+        except serial.SerialException as e:
+            logging.error(f"Failed to open serial port {port}: {e}")
+            raise
+
+        loop = asyncio.get_running_loop()
+        fd = self.ser.fileno()
+        self.protocol = SerialProtocol()
+        self._reader, _ = await loop.connect_read_pipe(
+            lambda: self.protocol, os.fdopen(os.dup(fd), 'rb', buffering=0))
+        self._writer, _ = await loop.connect_write_pipe(
+            asyncio.Protocol, os.fdopen(os.dup(fd), 'wb', buffering=0))
+        logging.info(f"Connected to {port} at {baud} baud")
+
+    def write(self, opcode, data=None):
+        """
+        Queues a command for the create, this never blocks.
+
+        opcode: see create api
+        data: a tuple with data associated with a given opcode (see api)
+        """
+        msg = (opcode,)
+        if data:
+            msg += data
+        self._writer.write(bytes(msg))
+
+    async def read(self, num_bytes):
+        """
+        Read 'num_bytes' bytes from the robot. Like pyserial, fewer bytes are
+        returned if they don't all arrive within the timeout.
+        """
+        if self.protocol is None:
+            raise Exception("You must open the serial port first")
+
+        buf = self.protocol.buffer
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        while len(buf) < num_bytes and not self._reader.is_closing():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self.protocol.wait_for_data(), remaining)
+            except asyncio.TimeoutError:
+                break
+
+        data = bytes(buf[:num_bytes])
+        del buf[:num_bytes]
+        return data
+
+    def flush(self):
+        """
+        Flush the input buffer, discarding all contents
+        """
+        if self.protocol is None:
+            raise Exception("You must open the serial port first")
+
+        self.protocol.buffer.clear()
+
+    def close(self):
+        """
+        Closes the serial connection.
+        """
+        if self._reader is not None:
+            self._reader.close()
+            self._writer.close()
+            self._reader = self._writer = None
+        self.protocol = None
+        if self.ser.is_open:
+            logging.info(f"Closing port {self.ser.port} at {self.ser.baudrate} baud")
+            self.ser.close()
+
+
+class AsyncCreate2(object):
+    """
+    asyncio version of Create2. Commands are coroutines and the mode
+    changes await instead of sleeping, so many robots share one loop.
+
+        async with AsyncCreate2('/dev/ttyUSB0') as robot:
+            await robot.start()
+            await robot.safe()
+            await robot.drive_direct(100, 100)
+            async for sensors in robot.frames():
+                ...
+    """
+
+    def __init__(self, port, baud=115200):
+        self.port = port
+        self.baud = baud
+        self.SCI = AsyncSerialCommandInterface()
+        self.sampling_rate = 0.015
+        self.sleep_timer = 0.5
+        self.mode_timeout = 1.0
+        self.mode_poll_interval = 0.005
+        self.song_list = {}
+
+    async def open(self):
+        """
+        Opens the serial port and sets up the beep song (4)
+        """
+        await self.SCI.open(self.port, self.baud)
+        await self.createSong(4, [64, 16])
+        return self
+
+    async def close(self):
+        """
+        Stops the robot and closes the serial port
+        """
+        if self.SCI.protocol is not None:
+            await self.stop_stream()
+            await self.drive_direct(0, 0)
+            await asyncio.sleep(0.1)  # let the write pipe drain
+        self.SCI.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    # ------------------- Mode Control ------------------------
+
+    async def _wait_for_mode(self, mode, timeout=None):
+        """
+        Waits until the robot reports `mode` in packet 35, see Create2._wait_for_mode()
+        """
+        timeout = self.mode_timeout if timeout is None else timeout
+        try:
+            await asyncio.wait_for(self._poll_mode(mode), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logging.warning(f"Robot did not report mode {MODES(mode).name} within {timeout} s")
+            return False
+
+    async def _poll_mode(self, mode):
+        if self.streaming:
+            async for sensors in self.frames():
+                if sensors.open_interface_mode == mode:
+                    return
+        while True:
+            try:
+                if (await self.query(SENSOR_PACKETS.OI_MODE)).open_interface_mode == mode:
+                    return
+            except Exception:
+                pass  # no (complete) reply yet
+            await asyncio.sleep(self.mode_poll_interval)
+
+    async def start(self, timeout=None):
+        """
+        Puts the Create 2 into Passive mode. Returns True once the robot
+        reports it, False after timeout seconds (default self.mode_timeout).
+        """
+        self.SCI.write(OPCODES.START)
+        return await self._wait_for_mode(MODES.PASSIVE, timeout)
+
+    async def getMode(self):
+        """
+        Return the Mode
+        """
+        if self.streaming:
+            sensors = await self.get_sensors()
+            return sensors.open_interface_mode
+        ans = await self.query(SENSOR_PACKETS.OI_MODE)
+        return ans.open_interface_mode
+
+    async def reset(self):
+        """
+        Resets the robot, returns whatever the robot printed
+        """
+        await self.clearSongMemory()
+        async with self.SCI.lock:
+            self.SCI.write(OPCODES.RESET)
+            await asyncio.sleep(1)
+            return await self.SCI.read(128)
+
+    async def stop(self):
+        """
+        Puts the Create 2 into OFF mode.
+        """
+        await self.clearSongMemory()
+        self.SCI.write(OPCODES.STOP)
+        await asyncio.sleep(self.sleep_timer)
+
+    async def safe(self, timeout=None):
+        """
+        Puts the Create 2 into safe mode, see start() for the return value.
+        """
+        self.SCI.write(OPCODES.SAFE)
+        confirmed = await self._wait_for_mode(MODES.SAFE, timeout)
+        await self.clearSongMemory()
+        return confirmed
+
+    async def full(self, timeout=None):
+        """
+        Puts the Create 2 into full mode, see start() for the return value.
+        """
+        self.SCI.write(OPCODES.FULL)
+        confirmed = await self._wait_for_mode(MODES.FULL, timeout)
+        await self.clearSongMemory()
+        return confirmed
+
+    async def power(self, timeout=None):
+        """
+        Puts the Create 2 into Passive mode.
+        """
+        self.SCI.write(OPCODES.POWER)
+        return await self._wait_for_mode(MODES.PASSIVE, timeout)
+
+    async def clean(self, timeout=None):
+        """
+        Activates the Create2 Clean mode (the OI switches to Passive)
+        """
+        self.SCI.write(OPCODES.CLEAN)
+        return await self._wait_for_mode(MODES.PASSIVE, timeout)
+
+    async def dock(self, timeout=None):
+        """
+        Create2 attempts to seek the dock (the OI switches to Passive)
+        """
+        self.SCI.write(OPCODES.SEEK_DOCK)
+        return await self._wait_for_mode(MODES.PASSIVE, timeout)
+
+    # ------------------ Drive Commands ------------------
+
+    async def drive_stop(self):
+        await self.drive_direct(0, 0)
+        await asyncio.sleep(self.sleep_timer)
+
+    def limit(self, val, low, hi):
+        val = val if val < hi else hi
+        val = val if val > low else low
+        return val
+
+    async def drive_direct(self, l_vel, r_vel):
+        """
+        Drive motors directly: [-500, 500] mm/sec
+        """
+        l_vel = self.limit(l_vel, -500, 500)
+        r_vel = self.limit(r_vel, -500, 500)
+        data = struct.unpack('4B', struct.pack('>2h', r_vel, l_vel))
+        self.SCI.write(OPCODES.DRIVE_DIRECT, data)
+
+    async def drive_pwm(self, r_pwm, l_pwm):
+        """
+        Drive motors PWM directly: [-255, 255] PWM
+        """
+        r_pwm = self.limit(r_pwm, -255, 255)
+        l_pwm = self.limit(l_pwm, -255, 255)
+        data = struct.unpack('4B', struct.pack('>2h', r_pwm, l_pwm))
+        self.SCI.write(OPCODES.DRIVE_PWM, data)
+
+    # ------------------------ LED ----------------------------
+
+    async def led(self, led_bits=0, power_color=0, power_intensity=0):
+        """
+        See Create2.led()
+        """
+        self.SCI.write(OPCODES.LED, (led_bits, power_color, power_intensity))
+
+    async def digit_led_ascii(self, display_string):
+        """
+        See Create2.digit_led_ascii()
+        """
+        display_list = [32]*4
+        for i, c in enumerate(display_string[:4]):
+            val = ord(c.upper())
+            display_list[i] = val if 32 <= val <= 126 else 32
+
+        self.SCI.write(OPCODES.DIGIT_LED_ASCII, tuple(display_list))
+
+    # ------------------------ Songs ----------------------------
+
+    async def clearSongMemory(self):
+        for sn in range(4):
+            await self.createSong(sn, [70, 0])
+            await self.playSong(sn)
+
+    async def createSong(self, song_num, notes):
+        """
+        See Create2.createSong()
+        """
+        size = len(notes)
+        if (2 > size > 32) or (size % 2 != 0):
+            raise Exception('Songs must be between 1-16 notes and have a duration for each note')
+
+        notes = tuple(notes)
+        dt = sum(notes[1::2]) / 64
+
+        self.SCI.write(OPCODES.SONG, (song_num, size//2,) + notes)
+        self.song_list[song_num] = dt
+        return dt
+
+    async def playSong(self, song_num):
+        """
+        Play a song, returns the song duration in seconds
+        """
+        try:
+            time_len = self.song_list[song_num]
+        except KeyError:
+            print("*** Invalid Song: {} ***".format(song_num))
+            return 0
+
+        self.SCI.write(OPCODES.PLAY, (song_num,))
+        return time_len
+
+    # ------------------------ Sensors ----------------------------
+
+    async def get_sensors(self):
+        """
+        return: the packet 100 Sensors namedtuple, the latest streamed
+        frame when streaming
+        """
+        if self.streaming:
+            if self.SCI.protocol.latest is None:
+                async for sensors in self.frames():
+                    return sensors
+            return self.SCI.protocol.latest
+
+        async with self.SCI.lock:
+            self.SCI.flush()
+            self.SCI.write(OPCODES.SENSORS, (100,))
+            data = await self.SCI.read(80)
+        return SensorPacketDecoder(data)
+
+    async def query(self, *packet_ids):
+        """
+        See Create2.query()
+        """
+        if self.streaming:
+            raise Exception('Stop the sensor stream before querying, use get_sensors() instead')
+
+        decoder = sensor_query(tuple(packet_ids))
+        async with self.SCI.lock:
+            self.SCI.flush()
+            self.SCI.write(OPCODES.QUERY_LIST, (len(decoder.packet_ids),) + decoder.packet_ids)
+            data = await self.SCI.read(decoder.size)
+        return decoder.decode(data)
+
+    @property
+    def streaming(self):
+        return self.SCI.protocol is not None and self.SCI.protocol.streaming
+
+    async def start_stream(self):
+        """
+        Starts streaming packet 100 every 15 ms, see frames()
+        """
+        if self.streaming:
+            return
+        async with self.SCI.lock:
+            self.SCI.flush()
+            self.SCI.protocol.rx.clear()
+            self.SCI.protocol.streaming = True
+            self.SCI.write(OPCODES.STREAM, (1, 100))
+
+    async def stop_stream(self):
+        """
+        Stops the sensor stream, if one is running.
+        """
+        if not self.streaming:
+            return
+        self.SCI.write(OPCODES.PAUSE_RESUME_STREAM, (0,))
+        self.SCI.protocol.streaming = False
+        self.SCI.protocol._wake()
+        for queue in self.SCI.protocol.subscribers:
+            queue.event.set()
+
+    async def frames(self, maxlen=1):
+        """
+        Async iterator over streamed Sensors frames, starts the stream if
+        needed. A consumer that falls behind only sees the newest `maxlen`
+        frames.
+        """
+        await self.start_stream()
+        protocol = self.SCI.protocol
+        queue = _FrameQueue(maxlen)
+        protocol.subscribers.append(queue)
+        try:
+            while protocol.streaming:
+                if not queue:
+                    queue.event.clear()
+                    await queue.event.wait()
+                    continue
+                yield queue.popleft()
+        finally:
+            protocol.subscribers.remove(queue)
@@ -12,13 +12,13 @@
 create_oi.py - Contains the Open Interface (OI) constants for the iRobot Create 2.
 """
 
-from enum import IntEnum
+from enum import Enum, IntEnum
 
 # Note for students: 0x?? is equivalent to 0b????????, hex is used for compactness
 
 # -------------------- Robot Specs --------------------
-class ROBOT(IntEnum):
-	"""Information about the robot specifications."""
+class ROBOT(float, Enum):
+	"""Information about the robot specifications (floats, an IntEnum would truncate them)."""
 	TICK_PER_REV     = 508.8  # Number of encoder ticks per wheel revolution
 	WHEEL_DIAMETER   = 72  # Diameter of wheels in mm
 	WHEEL_BASE       = 235  # Distance between wheels in mm
@@ -51,6 +51,19 @@ class BAUD_RATE(IntEnum):
 	BAUD_57600  = 10 # 57600 baud rate
 	BAUD_115200 = 11 # 115200 baud rate
 
+	@property
+	def bps(self):
+		"""Bits per second, ie, BAUD_RATE.BAUD_19200.bps == 19200"""
+		return int(self.name[len('BAUD_'):])
+
+	@classmethod
+	def from_bps(cls, bps):
+		"""The code for a rate in bits per second"""
+		try:
+			return cls[f"BAUD_{bps}"]
+		except KeyError:
+			raise Exception(f"The Create 2 does not support {bps} baud") from None
+
 # -------------------- Operating Modes --------------------
 class MODES(IntEnum):
 	"""Operating modes of the robot that define its behavior and control access."""
@@ -150,6 +163,42 @@ class OPCODES(IntEnum):
 	STREAM              = 148  # Enable continuous sensor data streaming
 	PAUSE_RESUME_STREAM = 150  # Pause or resume data stream
 
+# number of data bytes after each fixed length opcode
+COMMAND_ARGUMENTS = {
+	OPCODES.START: 0,
+	OPCODES.RESET: 0,
+	OPCODES.STOP: 0,
+	OPCODES.BAUD: 1,
+	OPCODES.SAFE: 0,
+	OPCODES.FULL: 0,
+	OPCODES.CLEAN: 0,
+	OPCODES.MAX: 0,
+	OPCODES.SPOT: 0,
+	OPCODES.SEEK_DOCK: 0,
+	OPCODES.POWER: 0,
+	OPCODES.SCHEDULE: 15,
+	OPCODES.SET_DAY_TIME: 3,
+	OPCODES.DRIVE: 4,
+	OPCODES.DRIVE_DIRECT: 4,
+	OPCODES.DRIVE_PWM: 4,
+	OPCODES.MOTORS: 1,
+	OPCODES.MOTORS_PWM: 3,
+	OPCODES.LED: 3,
+	OPCODES.SCHEDULING_LED: 2,
+	OPCODES.BUTTONS: 1,
+	OPCODES.DIGIT_LED_ASCII: 4,
+	OPCODES.PLAY: 1,
+	OPCODES.SENSORS: 1,
+	OPCODES.PAUSE_RESUME_STREAM: 1,
+}
+
+# variable length opcodes: (data bytes up to and including the count, bytes per counted item)
+VARIABLE_COMMANDS = {
+	OPCODES.SONG: (2, 2),        # [song number][length] + length * [note][duration]
+	OPCODES.QUERY_LIST: (1, 1),  # [n] + n * [packet id]
+	OPCODES.STREAM: (1, 1),      # [n] + n * [packet id]
+}
+
 	# -------------------- Sensors --------------------
 class CHARGE_SOURCE(IntEnum):
 	"""Charge sources for the robot's battery."""
@@ -11,9 +11,14 @@
 
 import struct
 import time
-from createlib.packets import SensorPacketDecoder, decode
+import logging
+from createlib.packets import SensorPacketDecoder, SensorSnapshot, decode, sensor_query
 from createlib.create_serial import SerialCommandInterface
-from createlib.create_oi import OPCODES, SENSOR_PACKETS, DRIVE
+from createlib.sensor_stream import SensorStream
+from createlib.events import SensorEvents
+from createlib.reflex import Reflexes
+from createlib.motion import MotionController
+from createlib.create_oi import OPCODES, SENSOR_PACKETS, DRIVE, MODES, BAUD_RATE
 
 class Create2(object):
     """
@@ -21,19 +26,41 @@ class Create2(object):
     This is the only class that outside scripts should be interacting with.
     """
 
-    def __init__(self, port, baud=115200):
+    # baud rates probe_baud() tries, the two the Create 2 starts at first
+    PROBE_RATES = (115200, 19200, 57600, 38400, 28800, 14400, 9600, 4800, 2400, 1200, 600, 300)
+
+    def __init__(self, port, baud=115200, transport=None, negotiate=False, lazy_sensors=False):
         """
         Constructor, sets up class
         - creates serial port
         - creates decoder
         - sets the sampling_rate (15 ms)
+
+        transport: use this instead of a serial port, ie, a simulator.LoopbackTransport
+        negotiate: find the rate the robot is at and switch it to baud, see negotiate_baud()
+        lazy_sensors: get_sensors() and the stream return SensorSnapshots,
+            which decode a field when it is first read, instead of Sensors
         """
-        self.SCI = SerialCommandInterface()
+        self.SCI = SerialCommandInterface(transport)
         self.SCI.open(port, baud)
         self.decoder = None
         self.sampling_rate = 0.015
         self.sleep_timer = 0.5
+        self.mode_timeout = 1.0
+        self.mode_poll_interval = 0.005
         self.song_list = {}
+        self.stream = None
+        self.events = SensorEvents()
+        self.motion = MotionController(self)
+        self.reflexes = Reflexes(self.SCI, self.motion)
+        self.metrics = None
+        self._decoder = SensorSnapshot if lazy_sensors else SensorPacketDecoder
+        self.decode = self._decoder  # replaced by a timed one when metrics are on
+        self.probe_timeout = 0.05
+        self.bandwidth = None
+
+        if negotiate:
+            self.negotiate_baud(baud)
 
         # setup beep as song 4
         beep_song = [64, 16]
@@ -43,13 +70,20 @@ class Create2(object):
         """
         Destructor, cleans up when class goes out of scope
         """
+        if not self.SCI.ser.is_open:
+            return  # already closed
+
+        # stop streaming before anything else reads the port
+        self.stop_stream()
+
         # stop motors
         self.drive_stop()
         time.sleep(self.sleep_timer)
 
         # turn off LEDs
-        self.led()
-        self.digit_led_ascii('    ')
+        with self.SCI.batch():
+            self.led()
+            self.digit_led_ascii('    ')
         time.sleep(0.1)
 
         # close it down
@@ -65,21 +99,179 @@ class Create2(object):
         """
         self.SCI.close()
 
+    # ------------------- Baud Rate ------------------------
+
+    @property
+    def baud(self):
+        return self.SCI.ser.baudrate
+
+    def _reopen(self, baud):
+        self.SCI.open(self.SCI.ser.port, baud, self.SCI.ser.timeout)
+
+    def _responds(self):
+        """
+        True if the robot answers two OI mode queries at the current rate.
+        At the wrong rate it sees noise and answers nothing, or garbage that
+        is unlikely to be the same valid mode twice.
+        """
+        read_timeout = self.SCI.ser.timeout
+        self.SCI.ser.timeout = self.probe_timeout
+        try:
+            for start in (False, True):
+                if start:
+                    self.SCI.write(OPCODES.START)  # an OFF robot only answers after START
+                    time.sleep(self.sampling_rate)
+                try:
+                    modes = [self.query(SENSOR_PACKETS.OI_MODE).open_interface_mode for _ in range(2)]
+                except Exception:
+                    continue  # short or no reply
+                if modes[0] == modes[1] and modes[0] in MODES._value2member_map_:
+                    return True
+            return False
+        finally:
+            self.SCI.ser.timeout = read_timeout
+
+    def probe_baud(self, rates=None):
+        """
+        Finds the rate the robot talks at, ie, after a power cycle, trying
+        the current one first. The port is left open at the rate found.
+        A robot that is OFF is started (Passive mode).
+
+        rates: bits per second to try, defaults to PROBE_RATES
+        return: the rate in bits per second
+        """
+        if self.streaming:
+            raise Exception('Stop the sensor stream before probing the baud rate')
+        original = self.baud
+        rates = self.PROBE_RATES if rates is None else rates
+        for baud in [original] + [r for r in rates if r != original]:
+            if baud != self.baud:
+                self._reopen(baud)
+            if self._responds():
+                logging.info(f"Robot answers at {baud} baud")
+                return baud
+        self._reopen(original)
+        raise Exception(f"No answer from the robot on {self.SCI.ser.port} at any baud rate")
+
+    def set_baud(self, baud):
+        """
+        Switches the robot (OPCODES.BAUD) and then the port to a new rate,
+        waiting the 100 ms the OI needs before the next command.
+
+        baud: bits per second, one of BAUD_RATE
+        return: True if the robot answers at the new rate, otherwise the
+                port goes back to the old rate and it returns False
+        """
+        if self.streaming:
+            raise Exception('Stop the sensor stream before changing the baud rate')
+        code = BAUD_RATE.from_bps(baud)
+        original = self.baud
+        if baud == original:
+            return True
+        self.SCI.write(OPCODES.BAUD, (code,))
+        time.sleep(0.1)
+        self._reopen(baud)
+        if self._responds():
+            return True
+        logging.warning(f"Robot did not answer after switching to {baud} baud, staying at {original}")
+        self._reopen(original)
+        return False
+
+    def measure_bandwidth(self, duration=0.25):
+        """
+        Polls packet 100 back to back for `duration` seconds to measure how
+        many sensor bytes per second the link actually delivers at the
+        current rate (the result is also kept in self.bandwidth).
+
+        return: dict of baud, bytes_per_s, polls_per_s and wire_bytes_per_s
+                (the rate's limit, 10 bits per byte)
+        """
+        if self.streaming:
+            raise Exception('Stop the sensor stream before measuring the bandwidth')
+        received = polls = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            with self.SCI.lock:
+                self.SCI.write(OPCODES.SENSORS, (100,))
+                received += len(self.SCI.read(80))
+            polls += 1
+        elapsed = time.perf_counter() - start
+        self.bandwidth = {
+            'baud': self.baud,
+            'bytes_per_s': received / elapsed,
+            'polls_per_s': polls / elapsed,
+            'wire_bytes_per_s': self.baud / 10,
+        }
+        return self.bandwidth
+
+    def negotiate_baud(self, baud=115200, rates=None):
+        """
+        Connection bring-up: finds the robot's current rate (probe_baud()),
+        switches it to `baud` if needed (set_baud()) and measures what the
+        link delivers (measure_bandwidth()).
+
+        return: the measure_bandwidth() dict
+        """
+        current = self.probe_baud(rates)
+        if current != baud:
+            self.set_baud(baud)
+        return self.measure_bandwidth()
+
     # ------------------- Mode Control ------------------------
 
-    def start(self):
+    def _wait_for_mode(self, mode, timeout=None):
+        """
+        Waits until the robot reports `mode` in packet 35 (OI mode), from the
+        stream when streaming, otherwise by polling it with QUERY_LIST.
+
+        timeout: seconds, defaults to self.mode_timeout
+        return: True once the mode is confirmed, False on timeout
+        """
+        timeout = self.mode_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.streaming:
+                sensors = self.stream.wait(timeout=max(deadline - time.monotonic(), 0))
+                current = sensors.open_interface_mode if sensors else None
+            else:
+                # don't let a robot that never answers hold us for the whole read timeout
+                read_timeout = self.SCI.ser.timeout
+                self.SCI.ser.timeout = max(min(deadline - time.monotonic(), read_timeout or timeout), 0.001)
+                try:
+                    current = self.query(SENSOR_PACKETS.OI_MODE).open_interface_mode
+                except Exception:
+                    current = None  # no (complete) reply yet
+                finally:
+                    self.SCI.ser.timeout = read_timeout
+            if current == mode:
+                return True
+            if time.monotonic() >= deadline:
+                logging.warning(f"Robot did not report mode {MODES(mode).name} within {timeout} s (last: {current})")
+                return False
+            if not self.streaming:
+                time.sleep(self.mode_poll_interval)
+
+    def start(self, timeout=None):
         """
         Puts the Create 2 into Passive mode.
 
         You must always send the Start commandbefore sending any other commands to the OI.
+        Returns as soon as the robot reports Passive mode (True), or False
+        after timeout seconds (default self.mode_timeout).
         """
         self.SCI.write(OPCODES.START)
-        time.sleep(self.sleep_timer)
+        return self._wait_for_mode(MODES.PASSIVE, timeout)
 
     def getMode(self):
         """
         Return the Mode
         """
+        if self.streaming:
+            sensors = self.get_sensors()
+            byte = sensors.open_interface_mode if sensors else 'Error, not mode returned'
+            print(f"Mode: {byte}")
+            return
+
         self.SCI.write(OPCODES.SENSORS, (SENSOR_PACKETS.OI_MODE,))
         time.sleep(self.sampling_rate)
         ans = self.SCI.read(1)
@@ -130,45 +322,47 @@ class Create2(object):
         self.SCI.write(OPCODES.STOP)
         time.sleep(self.sleep_timer)
 
-    def safe(self):
+    def safe(self, timeout=None):
         """
-        Puts the Create 2 into safe mode. Blocks for a short (<.5 sec) amount
-        of time so the bot has time to change modes.
+        Puts the Create 2 into safe mode. Blocks until the robot reports
+        Safe mode, see start() for the return value and timeout.
         """
         self.SCI.write(OPCODES.SAFE)
-        time.sleep(self.sleep_timer)
+        confirmed = self._wait_for_mode(MODES.SAFE, timeout)
         self.clearSongMemory()
+        return confirmed
 
-    def full(self):
+    def full(self, timeout=None):
         """
-        Puts the Create 2 into full mode. Blocks for a short (<.5 sec) amount
-        of time so the bot has time to change modes.
+        Puts the Create 2 into full mode. Blocks until the robot reports
+        Full mode, see start() for the return value and timeout.
         """
         self.SCI.write(OPCODES.FULL)
-        time.sleep(self.sleep_timer)
+        confirmed = self._wait_for_mode(MODES.FULL, timeout)
         self.clearSongMemory()
+        return confirmed
 
-    def power(self):
+    def power(self, timeout=None):
         """
         Puts the Create 2 into Passive mode. The OI can be in Safe, or
         Full mode to accept this command.
         """
         self.SCI.write(OPCODES.POWER)
-        time.sleep(self.sleep_timer)
+        return self._wait_for_mode(MODES.PASSIVE, timeout)
 
-    def clean(self):
+    def clean(self, timeout=None):
         """
-        Activates the Create2 Clean mode
+        Activates the Create2 Clean mode (the OI switches to Passive)
         """
         self.SCI.write(OPCODES.CLEAN)
-        time.sleep(self.sleep_timer)
+        return self._wait_for_mode(MODES.PASSIVE, timeout)
 
-    def dock(self):
+    def dock(self, timeout=None):
         """
-        Create2 attempts to seek the dock
+        Create2 attempts to seek the dock (the OI switches to Passive)
         """
         self.SCI.write(OPCODES.SEEK_DOCK)
-        time.sleep(self.sleep_timer)
+        return self._wait_for_mode(MODES.PASSIVE, timeout)
         
     # ------------------ Drive Commands ------------------
 
@@ -199,6 +393,20 @@ class Create2(object):
         data = struct.unpack('4B', struct.pack('>2h', r_pwm, l_pwm))  # write do this?
         self.SCI.write(OPCODES.DRIVE_PWM, data)
 
+    def send_many(self, commands):
+        """
+        Sends several commands with a single serial write.
+
+        commands: an iterable of opcodes or (opcode, data) tuples, ie,
+            robot.send_many([(OPCODES.LED, (0, 0, 0)), OPCODES.SAFE])
+        """
+        with self.SCI.batch():
+            for cmd in commands:
+                if isinstance(cmd, tuple):
+                    self.SCI.write(*cmd)
+                else:
+                    self.SCI.write(cmd)
+
     # ------------------------ LED ----------------------------
 
     def led(self, led_bits=0, power_color=0, power_intensity=0):
@@ -238,11 +446,11 @@ class Create2(object):
     # ------------------------ Songs ----------------------------
 
     def clearSongMemory(self):
-        for sn in range(4):
-            song = [70,0]
-            self.createSong(sn,song)
-            self.playSong(sn)
-        time.sleep(0.1)
+        with self.SCI.batch():
+            for sn in range(4):
+                song = [70,0]
+                self.createSong(sn,song)
+                self.playSong(sn)
 
     def createSong(self, song_num, notes):
         """
@@ -302,7 +510,16 @@ class Create2(object):
         """
         return: a namedtuple
         WARNING: returns pkt 100, everything. And it is the default packet request now.
+
+        While streaming, this returns the latest streamed snapshot instead
+        of polling the robot.
         """
+        if self.streaming:
+            sensors = self.stream.latest
+            if sensors is None:
+                sensors = self.stream.wait(timeout=self.SCI.ser.timeout)
+            return sensors
+
         with self.SCI.lock:
             opcode = OPCODES.SENSORS
             cmd = (100,)
@@ -312,6 +529,187 @@ class Create2(object):
             self.SCI.write(opcode, cmd)
             time.sleep(self.sampling_rate)  # wait 15 msec
             packet_byte_data = self.SCI.read(sensor_pkt_len)
-            sensors = SensorPacketDecoder(packet_byte_data)
+            if len(packet_byte_data) != sensor_pkt_len:
+                # the rest may still show up, drop it so it doesn't end up
+                # at the front of the next reply and shift every field
+                time.sleep(self.sampling_rate)
+                self.SCI.flush()
+                raise Exception(f"Short sensor read: {len(packet_byte_data)} of {sensor_pkt_len} bytes")
+            sensors = self.decode(packet_byte_data)
 
             return sensors
+
+    def query(self, *packet_ids):
+        """
+        Reads only the requested sensor packets with a single QUERY_LIST.
+
+        packet_ids: SENSOR_PACKETS ids, ie, query(SENSOR_PACKETS.ENCODER_LEFT, SENSOR_PACKETS.ENCODER_RIGHT)
+        return: a namedtuple whose fields are named like the Sensors fields
+        """
+        if not packet_ids:
+            raise Exception('query() needs at least one sensor packet id')
+        if self.streaming:
+            raise Exception('Stop the sensor stream before querying, use get_sensors() instead')
+
+        decoder = sensor_query(tuple(packet_ids))
+
+        with self.SCI.lock:
+            self.SCI.flush()
+            self.SCI.write(OPCODES.QUERY_LIST, (len(decoder.packet_ids),) + decoder.packet_ids)
+            data = self.SCI.read(decoder.size)
+
+        return decoder.decode(data)
+
+    @property
+    def streaming(self):
+        return self.stream is not None and self.stream.running
+
+    def start_stream(self, reader=True):
+        """
+        Starts streaming packet 100 every 15 ms. A background thread decodes
+        each frame, so get_sensors() returns immediately and drive commands
+        no longer wait behind a sensor read.
+
+        reader: False if the caller reads the port itself, see SensorStream.start()
+        returns: the SensorStream, see SensorStream.add_listener()
+        """
+        if not self.streaming:
+            self.stream = SensorStream(self.SCI)
+            self.stream.decode = self.decode
+            self.stream.add_raw_listener(self.reflexes)  # first, it is the latency critical one
+            self.stream.add_raw_listener(self.motion)
+            self.stream.add_raw_listener(self.events)
+            self.stream.start(reader)
+        return self.stream
+
+    def stop_stream(self):
+        """
+        Stops the sensor stream, if one is running.
+        """
+        if self.stream is not None:
+            self.motion.cancel('stopped, the sensor stream ended')
+            self.stream.stop()
+            self.stream = None
+
+    def on(self, name, callback, debounce=0, edge=None):
+        """
+        Calls callback(name, value, timestamp_ns) from the stream reader
+        when a sensor changes, ie, robot.on('bumps_wheeldrops.bump_left', cb).
+        Changes are only seen while streaming, see SensorEvents.on() for
+        the arguments.
+
+        returns: the Subscription, pass it to off() to unsubscribe
+        """
+        return self.events.on(name, callback, debounce, edge)
+
+    def off(self, subscription):
+        """
+        Removes a subscription returned by on()
+        """
+        self.events.off(subscription)
+
+    # ------------------------ Motion ----------------------------
+
+    @property
+    def pose(self):
+        """
+        The odometry Pose (x, y mm, theta radians) since the stream started
+        """
+        return self.motion.pose
+
+    def drive_distance(self, mm, speed=200, timeout=None):
+        """
+        Drives straight for mm millimeters (negative is backwards) and stops
+        within a sensor frame of it, measured with the wheel encoders. Starts
+        the sensor stream if needed.
+
+        returns: a concurrent.futures.Future of the distance travelled (mm),
+                 see MotionController.drive_distance()
+        """
+        return self.motion.drive_distance(mm, speed, timeout)
+
+    def turn(self, deg, speed=100, timeout=None):
+        """
+        Turns in place by deg degrees (counter clockwise is positive), see drive_distance()
+
+        returns: a concurrent.futures.Future of the angle turned (degrees)
+        """
+        return self.motion.turn(deg, speed, timeout)
+
+    def follow(self, waypoints, speed=200, lookahead=150, relative=False, timeout=None, **kwargs):
+        """
+        Follows a path of (x, y) mm waypoints (a list or NumPy array) with
+        pure pursuit, updating the wheel speeds on every sensor frame.
+
+        returns: a concurrent.futures.Future of the mm of path covered,
+                 see MotionController.follow()
+        """
+        return self.motion.follow(waypoints, speed, lookahead, relative, timeout, **kwargs)
+
+    def stop_motion(self):
+        """
+        Stops a running drive_distance(), turn() or follow()
+        """
+        self.motion.cancel()
+
+    # ------------------------ Metrics ----------------------------
+
+    def enable_metrics(self, metrics=None):
+        """
+        Turns on the SerialCommandInterface counters (see
+        SerialCommandInterface.enable_metrics()) plus packet 100 decode time,
+        get_sensors() and query() latency and the stream frame counts.
+        Off by default, and free when off.
+
+        returns: the Metrics, see Metrics.snapshot() and Metrics.to_prometheus()
+        """
+        self.metrics = metrics = self.SCI.enable_metrics(metrics)
+        decode_time = metrics.histogram('decode', 'Time to decode one packet 100')
+        get_sensors_time = metrics.histogram('get_sensors', 'get_sensors() call to return')
+        query_time = metrics.histogram('query', 'query() call to return')
+        metrics.gauge('stream_frames', lambda: self.stream.frames if self.stream else 0,
+                      'Frames received by the current sensor stream')
+        metrics.gauge('stream_bad_frames', lambda: self.stream.bad_frames if self.stream else 0,
+                      'Bad frames skipped by the current sensor stream')
+        metrics.gauge('stream_dropped_frames', lambda: self.stream.dropped_frames if self.stream else 0,
+                      'Frames lost to corruption or dropped bytes on the current sensor stream')
+
+        decoder = self._decoder
+        get_sensors = Create2.get_sensors
+        query = Create2.query
+
+        def timed_decode(data, offset=None):
+            start = time.monotonic_ns()
+            sensors = decoder(data, offset)
+            decode_time.record(time.monotonic_ns() - start)
+            return sensors
+
+        def timed_get_sensors():
+            start = time.monotonic_ns()
+            sensors = get_sensors(self)
+            get_sensors_time.record(time.monotonic_ns() - start)
+            return sensors
+
+        def timed_query(*packet_ids):
+            start = time.monotonic_ns()
+            result = query(self, *packet_ids)
+            query_time.record(time.monotonic_ns() - start)
+            return result
+
+        self.decode = timed_decode
+        self.get_sensors = timed_get_sensors
+        self.query = timed_query
+        if self.stream is not None:
+            self.stream.decode = timed_decode
+        return metrics
+
+    def disable_metrics(self):
+        """
+        Goes back to the uninstrumented methods, self.metrics keeps what was recorded
+        """
+        self.SCI.disable_metrics()
+        self.decode = self._decoder
+        for name in ('get_sensors', 'query'):
+            self.__dict__.pop(name, None)
+        if self.stream is not None:
+            self.stream.decode = self._decoder
@@ -13,25 +13,125 @@
 #############################################
 # Changelog:
 #   + threading - repeatable lock for "locking" communication channel
+#   + preallocated receive buffer filled with readinto()
+#   + batch() to coalesce several commands into one write
+#   + enable_metrics() for byte, command, lock wait and read counters
 
 import serial 
 import struct
 import threading
 import logging
+import select
+import io
+import time
+from contextlib import contextmanager
+from createlib.metrics import Metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
+# struct.Struct('nB') per message length, built on first use
+_packers = {}
+
+def _packer(size):
+    try:
+        return _packers[size]
+    except KeyError:
+        packer = _packers[size] = struct.Struct(f'{size}B')
+        return packer
+
+
+class ReceiveBuffer(object):
+    """
+    Preallocated buffer for incoming bytes.
+
+    Bytes are read straight into the free space at the end of `buf` and
+    parsers unpack them in place (Struct.unpack_from at an offset), so no
+    bytes object is created per frame. Unlike a wrapping ring, the unread
+    bytes are moved back to the front once the end is reached, which keeps
+    every frame contiguous. That move is at most one partial frame.
+    """
+
+    def __init__(self, size=4096):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.head = 0  # first unread byte
+        self.tail = 0  # end of the unread bytes
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def writable(self):
+        """
+        Returns a memoryview of the free space, call commit() with the
+        number of bytes written into it.
+        """
+        if self.tail == len(self.buf):
+            self.compact()
+        return self.view[self.tail:]
+
+    def commit(self, num_bytes):
+        self.tail += num_bytes
+
+    def extend(self, data):
+        """
+        Copies data in, for producers that hand over bytes objects.
+        """
+        n = len(data)
+        if len(self.buf) - self.tail < n:
+            self.compact()
+            if len(self.buf) - self.tail < n:
+                raise Exception(f"Receive buffer overflow, {n} bytes do not fit")
+        self.buf[self.tail:self.tail + n] = data
+        self.tail += n
+
+    def find(self, value, start=None):
+        """
+        Offset in buf of the next byte equal to value, or -1
+        """
+        return self.buf.find(value, self.head if start is None else start, self.tail)
+
+    def consume(self, num_bytes):
+        self.head += num_bytes
+        if self.head >= self.tail:
+            self.head = self.tail = 0
+
+    def compact(self):
+        n = self.tail - self.head
+        if self.head:
+            # slicing the bytearray copies, so the overlapping move is safe
+            self.buf[:n] = self.buf[self.head:self.tail]
+            self.head, self.tail = 0, n
+        if n == len(self.buf):
+            # nothing parseable in a full buffer, start over
+            self.clear()
+
+    def clear(self):
+        self.head = self.tail = 0
+
+
 class SerialCommandInterface(object):
     """Handles sending commands to the iRobot Create 2 over serial."""
 
-    def __init__(self):
+    def __init__(self, transport=None):
         """
         Initializes a serial communication object but does not open it yet.
+
+        transport: what to talk through instead of a serial.Serial, ie, a
+            simulator.LoopbackTransport. It needs the parts of the pyserial
+            Serial API used here: port, baudrate, timeout, is_open, rts, dtr,
+            open(), close(), write(), flush(), read(), in_waiting and
+            flushInput().
         """
 
-        self.ser = serial.Serial()
+        self.ser = serial.Serial() if transport is None else transport
         self.lock = threading.RLock()
+        self.rx = ReceiveBuffer()
+        self._raw = None
+        self._batch_buf = bytearray(256)
+        self._batch_len = 0
+        self._batch_depth = 0
+        self.metrics = None
 
     def __del__(self):
         """
@@ -59,6 +159,8 @@ class SerialCommandInterface(object):
         try:
             self.ser.open()
             logging.info(f"Connected to {port} at {baud} baud")
+            self.rx.clear()
+            self._raw = self._open_raw()
         except serial.SerialException as e:
             logging.error(f"Failed to open serial port {port}: {e}")
             raise
@@ -79,9 +181,52 @@ class SerialCommandInterface(object):
             if data:
                 msg += data
 
-            self.ser.write(struct.pack('B' * len(msg), *msg))
+            packer = _packer(len(msg))
+
+            if self._batch_depth:
+                end = self._batch_len + packer.size
+                if end > len(self._batch_buf):
+                    self._batch_buf.extend(bytes(max(end, 2 * len(self._batch_buf)) - len(self._batch_buf)))
+                packer.pack_into(self._batch_buf, self._batch_len, *msg)
+                self._batch_len = end
+                return
+
+            self.ser.write(packer.pack(*msg))
             self.ser.flush()
 
+    @contextmanager
+    def batch(self):
+        """
+        Collects every write() made inside the with block and sends them
+        with a single write and flush when the block exits.
+
+            with sci.batch():
+                sci.write(OPCODES.LED, (0, 0, 0))
+                sci.write(OPCODES.DRIVE_DIRECT, (0, 0, 0, 0))
+
+        The lock is held for the whole block so other threads' commands
+        do not end up in the middle of the batch. Batches can be nested,
+        the outermost one sends. If a block raises, the commands it queued
+        are dropped rather than sent as a partial batch.
+        """
+        with self.lock:
+            start = self._batch_len
+            self._batch_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._batch_len = start
+                raise
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth and self._batch_len:
+                    try:
+                        self.ser.write(memoryview(self._batch_buf)[:self._batch_len])
+                        self.ser.flush()
+                    finally:
+                        # a failed write must not be resent with the next batch
+                        self._batch_len = 0
+
     def read(self, num_bytes):
         """
         Read a string of 'num_bytes' bytes from the robot.
@@ -95,6 +240,115 @@ class SerialCommandInterface(object):
         with self.lock:
             return self.ser.read(num_bytes)
 
+    def fill(self):
+        """
+        Reads whatever the robot has sent into the receive buffer (self.rx),
+        waiting up to the port timeout for the first byte.
+
+        return: the number of bytes added
+        """
+        if not self.ser.is_open:
+            raise Exception("You must open the serial port first")
+
+        view = self.rx.writable()
+        if self._raw is not None:
+            ready, _, _ = select.select([self._raw], [], [], self.ser.timeout)
+            if not ready:
+                return 0
+            num_bytes = self._raw.readinto(view)
+            if num_bytes == 0:
+                raise serial.SerialException("device reports readiness to read but returned no data")
+            num_bytes = num_bytes or 0
+        else:
+            data = self.ser.read(min(max(self.ser.in_waiting, 1), len(view)))
+            num_bytes = len(data)
+            view[:num_bytes] = data
+
+        self.rx.commit(num_bytes)
+        return num_bytes
+
+    def enable_metrics(self, metrics=None):
+        """
+        Starts counting bytes in and out, commands per opcode, read short
+        counts and timeouts, and timing lock waits, writes and reads.
+
+        The instrumented write(), read() and fill() replace the plain ones
+        on this instance only, so a disabled (or never enabled) interface
+        pays nothing for them.
+
+        metrics: the Metrics to record into, a new one (or the one from a
+                 previous enable) if None
+        return: the Metrics
+        """
+        if metrics is None:
+            metrics = self.metrics or Metrics()
+        self.metrics = metrics
+        counters = metrics.counters
+        commands = counters[metrics.counter('serial_commands', 'Commands written, by opcode', label='opcode')]
+        metrics.counter('serial_bytes_out', 'Bytes written (batched bytes when queued)')
+        metrics.counter('serial_bytes_in', 'Bytes read')
+        metrics.counter('serial_short_reads', 'read() calls that returned fewer bytes than asked for')
+        metrics.counter('serial_read_timeouts', 'read() and fill() calls that returned no bytes')
+        lock_wait = metrics.histogram('serial_lock_wait', 'Time write() waited for the port lock')
+        write_time = metrics.histogram('serial_write', 'Time to write and flush one unbatched command')
+        read_time = metrics.histogram('serial_read', 'Time read() took, including the wait for the reply')
+
+        write = SerialCommandInterface.write
+        read = SerialCommandInterface.read
+        fill = SerialCommandInterface.fill
+
+        def timed_write(opcode, data=None):
+            start = time.monotonic_ns()
+            with self.lock:
+                locked = time.monotonic_ns()
+                write(self, opcode, data)
+                if not self._batch_depth:
+                    write_time.record(time.monotonic_ns() - locked)
+            lock_wait.record(locked - start)
+            commands[opcode] = commands.get(opcode, 0) + 1
+            counters['serial_bytes_out'] += 1 + len(data) if data else 1
+
+        def timed_read(num_bytes):
+            start = time.monotonic_ns()
+            data = read(self, num_bytes)
+            read_time.record(time.monotonic_ns() - start)
+            counters['serial_bytes_in'] += len(data)
+            if len(data) < num_bytes:
+                counters['serial_short_reads'] += 1
+                if not data:
+                    counters['serial_read_timeouts'] += 1
+            return data
+
+        def timed_fill():
+            num_bytes = fill(self)
+            counters['serial_bytes_in'] += num_bytes
+            if not num_bytes:
+                counters['serial_read_timeouts'] += 1
+            return num_bytes
+
+        self.write = timed_write
+        self.read = timed_read
+        self.fill = timed_fill
+        return metrics
+
+    def disable_metrics(self):
+        """
+        Goes back to the uninstrumented methods, self.metrics keeps what was recorded
+        """
+        for name in ('write', 'read', 'fill'):
+            self.__dict__.pop(name, None)
+
+    def _open_raw(self):
+        """
+        An unbuffered file object over the port's descriptor, its readinto()
+        does not allocate (pyserial's reads through a temporary bytes object).
+        Not available on Windows.
+        """
+        try:
+            return io.FileIO(self.ser.fileno(), 'rb', closefd=False)
+        except (AttributeError, OSError, ValueError, serial.SerialException):
+            return None
+
     def flush(self):
         """
         Flush the input buffer, discarding all contents
@@ -103,6 +357,7 @@ class SerialCommandInterface(object):
             raise Exception("You must open the serial port first")
 
         self.ser.flushInput()
+        self.rx.clear()
 
     def close(self):
         """
@@ -110,4 +365,5 @@ class SerialCommandInterface(object):
         """
         if self.ser.is_open:
             logging.info(f"Closing port {self.ser.port} at {self.ser.baudrate} baud")
+            self._raw = None
             self.ser.close()
\ No newline at end of file
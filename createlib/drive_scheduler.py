@@ -0,0 +1,123 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# Latest-value-wins DRIVE_DIRECT scheduler
+#
+# Teleop front ends (keyboard autorepeat, joysticks) request new wheel
+# velocities far faster than the robot needs them. Instead of writing each
+# request, the latest one is kept and at most one DRIVE_DIRECT is sent per
+# tick, and only if it differs from what the robot was last told.
+##############################################
+
+import threading
+import time
+from createlib.scheduler import default_scheduler
+
+
+class DriveScheduler(object):
+    """
+    Coalesces drive_direct() requests for a Create2.
+
+        drive = DriveScheduler(robot, period=0.05)
+        drive.drive_direct(200, 200)   # returns immediately
+        ...
+        drive.stop()
+
+    Counters:
+        requests: drive_direct() calls
+        sent:     DRIVE_DIRECT commands written to the robot
+        dropped:  requests replaced by a newer one before they were sent
+        skipped:  ticks whose latest request matched the last one sent
+    """
+
+    def __init__(self, robot, period=0.05, autostart=True, scheduler=None):
+        """
+        robot: a Create2
+        period: seconds between DRIVE_DIRECT commands
+        scheduler: the PeriodicScheduler to tick on, the shared default one if None
+        """
+        self.robot = robot
+        self.period = period
+        self.requests = 0
+        self.sent = 0
+        self.dropped = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._pending = None
+        self._last_sent = None
+        self._started = None
+        self.scheduler = scheduler
+        self.job = None
+        if autostart:
+            self.start()
+
+    def start(self):
+        if self.job is not None:
+            return
+        if self.scheduler is None:
+            self.scheduler = default_scheduler()
+        self._started = time.monotonic()
+        self.job = self.scheduler.add(self.period, self._tick, name='drive')
+
+    def stop(self, halt=True):
+        """
+        Stops the scheduler.
+
+        halt: send DRIVE_DIRECT 0, 0 right away so the robot doesn't keep
+              going at the last scheduled velocity
+        """
+        if self.job is not None:
+            self.job.cancel()
+            self.job = None
+        with self._lock:
+            self._pending = None
+        if halt:
+            self.robot.drive_direct(0, 0)
+            self._last_sent = (0, 0)
+
+    def drive_direct(self, l_vel, r_vel):
+        """
+        Requests new wheel velocities [-500, 500] mm/sec, sent on the next tick
+        """
+        with self._lock:
+            self.requests += 1
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (l_vel, r_vel)
+
+    @property
+    def send_rate(self):
+        """
+        DRIVE_DIRECT commands sent per second since start()
+        """
+        if self._started is None:
+            return 0.0
+        elapsed = time.monotonic() - self._started
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'skipped': self.skipped,
+            'send_rate': self.send_rate,
+            'overruns': self.job.overruns if self.job is not None else 0,
+        }
+
+    def _tick(self):
+        with self._lock:
+            cmd = self._pending
+            self._pending = None
+
+        if cmd is None:
+            return
+        if cmd == self._last_sent:
+            self.skipped += 1
+            return
+
+        self.robot.drive_direct(*cmd)
+        self._last_sent = cmd
+        self.sent += 1
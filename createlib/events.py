@@ -0,0 +1,216 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# Edge triggered sensor events
+#
+# SensorEvents is a raw stream listener that compares the bytes a
+# subscription watches in consecutive packet 100 frames, ie, the 0x02 bit
+# of the bumps_wheeldrops byte for 'bumps_wheeldrops.bump_left'. These are
+# plain integer compares done before the frame is decoded, and a callback
+# only runs when its value changes (and, with a debounce, stayed changed).
+#
+#   robot.start_stream()
+#   robot.on('bumps_wheeldrops.bump_left', on_bump, edge='rising')
+#   robot.on('cliff_front_left', on_cliff, debounce=0.03)
+#   robot.on('open_interface_mode', on_mode)
+#
+# Callbacks are called as callback(name, value, timestamp_ns) from the
+# stream reader thread, keep them short. An exception from one is logged
+# and the other subscriptions (and the stream) go on.
+##############################################
+
+import logging
+import threading
+from struct import Struct
+from createlib.packets import PACKET_100, PACKET_100_LAYOUT, BITFIELD_TABLES, BITFIELD_MASKS
+
+# Sensors field name -> (byte offset in packet 100, struct format)
+_FIELDS = {name: (offset, fmt) for name, offset, fmt in PACKET_100_LAYOUT}
+
+
+class Subscription(object):
+    """
+    One callback watching one sensor field or bit, returned by SensorEvents.on()
+    """
+
+    __slots__ = ('name', 'callback', 'mask', 'debounce', 'edge', 'value', 'pending', 'since', 'active', '_convert', '_order')
+
+    def __init__(self, name, callback, mask, convert, debounce, edge, order=int):
+        self.name = name
+        self.callback = callback
+        self.mask = mask
+        self.debounce = debounce
+        self.edge = edge
+        self.value = None     # last reported (masked) raw value, None before the first frame
+        self.pending = None   # changed value waiting out the debounce
+        self.since = 0
+        self.active = True
+        self._convert = convert
+        self._order = order   # raw value -> the number edges compare, sign extends signed fields
+
+    def _fire(self, raw, timestamp):
+        old = self.value
+        self.value = raw
+        self.pending = None
+        if self.edge is not None:
+            new, old = self._order(raw), self._order(old)
+            if self.edge == 'rising' and new < old:
+                return
+            if self.edge == 'falling' and new > old:
+                return
+        self.callback(self.name, self._convert(raw), timestamp)
+
+    def __repr__(self):
+        return f"Subscription({self.name!r}, debounce={self.debounce}, edge={self.edge!r})"
+
+
+class _Watch(object):
+    """ The subscriptions reading the same bytes of the frame """
+
+    __slots__ = ('offset', 'size', 'prev', 'subscriptions')
+
+    def __init__(self, offset, size):
+        self.offset = offset
+        self.size = size
+        self.prev = None
+        self.subscriptions = ()
+
+
+class SensorEvents(object):
+    """
+    Calls subscribers when a sensor field or a single bit of a bitfield
+    changes between stream frames. Register an instance as a raw listener:
+
+        events = SensorEvents()
+        stream.add_raw_listener(events)
+
+    Create2 does this itself, see Create2.on().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._watches = {}    # (offset, size) -> _Watch
+        self._active = ()     # the watches that have subscriptions, rebuilt by on()/off()
+        self._pending = []    # subscriptions in their debounce window (reader thread only)
+        self._frame = None    # copy of the last frame, the baseline of new subscriptions
+
+    def __len__(self):
+        return sum(len(w.subscriptions) for w in self._active)
+
+    def on(self, name, callback, debounce=0, edge=None):
+        """
+        Subscribes to changes of a sensor.
+
+        name: a Sensors field ('cliff_left', 'open_interface_mode', 'light_bumper') or
+              one bit of a bitfield ('bumps_wheeldrops.bump_left')
+        callback: callback(name, value, timestamp_ns), value is decoded
+                  like the Sensors field (bool, int or bitfield namedtuple)
+        debounce: seconds a new value has to hold before it is reported,
+                  changes that revert sooner are ignored
+        edge: 'rising' or 'falling' to report only increases (False -> True)
+              or decreases, None for both
+        return: the Subscription, pass it to off() to unsubscribe
+        """
+        if edge not in (None, 'rising', 'falling'):
+            raise Exception(f"Unknown edge: {edge}, use 'rising', 'falling' or None")
+
+        field, _, bit = name.partition('.')
+        if field not in _FIELDS:
+            raise Exception(f"Unknown sensor: {field}")
+        offset, fmt = _FIELDS[field]
+        size = Struct(fmt).size
+        order = int
+
+        if bit:
+            masks = BITFIELD_MASKS.get(field)
+            if masks is None or bit not in masks:
+                raise Exception(f"Unknown sensor bit: {name}")
+            mask = masks[bit]
+            convert = bool
+        elif field in BITFIELD_TABLES:
+            mask = 0xFF
+            convert = BITFIELD_TABLES[field].__getitem__
+        elif fmt.islower():
+            # signed, changes are found on the raw bytes, edges and the callback use the value
+            mask = (1 << 8 * size) - 1
+            sign = 1 << (8 * size - 1)
+            convert = order = lambda raw: raw - (raw & sign) * 2
+        else:
+            mask = (1 << 8 * size) - 1
+            convert = bool if fmt == '?' else int
+
+        sub = Subscription(name, callback, mask, convert, debounce * 1e9, edge, order)
+        with self._lock:
+            key = (offset, size)
+            watch = self._watches.get(key)
+            if watch is None:
+                watch = self._watches[key] = _Watch(*key)
+            frame = self._frame
+            if frame is not None:
+                # the last frame is the baseline, so a change on the very next
+                # one is reported (and a watch nobody used for a while is not stale)
+                watch.prev = frame[offset] if size == 1 else frame[offset] << 8 | frame[offset + 1]
+                sub.value = watch.prev & mask
+            elif watch.prev is not None:
+                sub.value = watch.prev & mask
+            watch.subscriptions += (sub,)
+            self._active = tuple(w for w in self._watches.values() if w.subscriptions)
+        return sub
+
+    def off(self, subscription):
+        """
+        Removes a subscription returned by on()
+        """
+        with self._lock:
+            subscription.active = False
+            for watch in self._watches.values():
+                if subscription in watch.subscriptions:
+                    watch.subscriptions = tuple(s for s in watch.subscriptions if s is not subscription)
+            self._active = tuple(w for w in self._watches.values() if w.subscriptions)
+
+    def __call__(self, buf, offset, timestamp):
+        """
+        Checks one frame, the signature matches SensorStream.add_raw_listener()
+        """
+        self._frame = bytes(buf[offset:offset + PACKET_100.size])
+        for watch in self._active:
+            i = offset + watch.offset
+            raw = buf[i] if watch.size == 1 else buf[i] << 8 | buf[i + 1]
+            if raw == watch.prev:
+                continue
+            first = watch.prev is None
+            watch.prev = raw
+
+            for sub in watch.subscriptions:
+                value = raw & sub.mask
+                if first or sub.value is None:
+                    sub.value = value  # baseline, not an edge
+                elif value == sub.value:
+                    sub.pending = None  # changed back within the debounce
+                elif not sub.debounce:
+                    self._fire(sub, value, timestamp)
+                elif value != sub.pending:
+                    if sub.pending is None:
+                        self._pending.append(sub)
+                    sub.pending = value
+                    sub.since = timestamp
+
+        if self._pending:
+            waiting = []
+            for sub in self._pending:
+                if sub.pending is None or not sub.active:
+                    continue
+                if timestamp - sub.since >= sub.debounce:
+                    self._fire(sub, sub.pending, timestamp)
+                else:
+                    waiting.append(sub)
+            self._pending = waiting
+
+    @staticmethod
+    def _fire(sub, value, timestamp):
+        try:
+            sub._fire(value, timestamp)
+        except Exception:
+            logging.exception(f"Sensor event callback for {sub.name} failed")
@@ -0,0 +1,165 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# Many robots, one I/O thread
+#
+# Every robot in a Fleet is a normal Create2, but instead of one stream
+# reader thread per robot, a single selectors loop waits on all of their
+# serial ports, reads whatever arrived and hands it to that robot's
+# SensorStream. Commands are still plain writes on each robot's port.
+#
+#   fleet = Fleet()
+#   fleet.add('red', '/dev/ttyUSB0')
+#   fleet.add('blue', '/dev/ttyUSB1')
+#   fleet.start()
+#   fleet.snapshot()      # {'red': Sensors, 'blue': Sensors}
+#   fleet.drive_stop()    # DRIVE_DIRECT 0, 0 to every robot
+#   fleet.close()
+#
+# NOTE: the ports must have a file descriptor (POSIX serial ports or ptys)
+##############################################
+
+import logging
+import selectors
+import threading
+from createlib.create_robot import Create2
+from createlib.create_oi import OPCODES
+
+
+class Fleet(object):
+    """
+    Opens many robots and multiplexes their sensor streams through one
+    selectors based I/O thread.
+    """
+
+    def __init__(self):
+        self.robots = {}
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    def __getitem__(self, name):
+        return self.robots[name]
+
+    def __iter__(self):
+        return iter(list(self.robots.items()))
+
+    def __len__(self):
+        return len(self.robots)
+
+    def add(self, name, port, baud=115200):
+        """
+        Opens a robot and, if the fleet is running, starts its stream.
+
+        return: the Create2
+        """
+        robot = Create2(port, baud)
+        with self._lock:
+            if name in self.robots:
+                robot.close()
+                raise Exception(f"A robot named {name} is already in the fleet")
+            self.robots[name] = robot
+            self._selector.register(robot.SCI.ser.fileno(), selectors.EVENT_READ, robot)
+        if self._running:
+            robot.start_stream(reader=False)
+        return robot
+
+    def remove(self, name):
+        """
+        Stops a robot's stream and takes it out of the fleet, the robot stays open.
+
+        return: the Create2
+        """
+        with self._lock:
+            robot = self.robots.pop(name)
+            self._unregister(robot)
+        robot.stop_stream()
+        return robot
+
+    # ------------------------ I/O loop ----------------------------
+
+    def start(self):
+        """
+        Starts every robot's stream and the I/O thread.
+        """
+        if self._running:
+            return
+        self._running = True
+        for _, robot in self:
+            robot.start_stream(reader=False)
+        self._thread = threading.Thread(target=self._run, name="create2-fleet", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the streams and the I/O thread.
+        """
+        if not self._running:
+            return
+        self._running = False
+        self._thread.join(timeout=1)
+        self._thread = None
+        for _, robot in self:
+            robot.stop_stream()
+
+    def close(self):
+        """
+        Stops the fleet and closes every robot's port. This skips the Create2
+        shutdown sequence, call drive_stop() first if they are moving.
+        """
+        self.stop()
+        with self._lock:
+            for robot in self.robots.values():
+                self._unregister(robot)
+                robot.close()
+            self.robots.clear()
+        self._selector.close()
+
+    def _unregister(self, robot):
+        # a port that failed in _run() is already unregistered
+        for key in list(self._selector.get_map().values()):
+            if key.data is robot:
+                self._selector.unregister(key.fd)
+
+    def _run(self):
+        while self._running:
+            for key, _ in self._selector.select(timeout=0.05):
+                robot = key.data
+                try:
+                    robot.SCI.fill()
+                except Exception as e:
+                    # stop watching a port that is gone instead of spinning on
+                    # it, and end its stream so robot.streaming says so
+                    logging.error(f"Fleet read from {robot.SCI.ser.port} failed: {e}")
+                    with self._lock:
+                        self._selector.unregister(key.fd)
+                    if robot.stream is not None:
+                        robot.stream.fail(e)
+                    continue
+                if robot.stream is not None and robot.stream.running:
+                    robot.stream.process()
+
+    # ------------------------ Commands ----------------------------
+
+    def broadcast(self, opcode, data=None):
+        """
+        Sends the same command to every robot.
+        """
+        for _, robot in self:
+            robot.SCI.write(opcode, data)
+
+    def drive_stop(self):
+        """
+        DRIVE_DIRECT 0, 0 to every robot, without Create2.drive_stop()'s wait
+        """
+        self.broadcast(OPCODES.DRIVE_DIRECT, (0, 0, 0, 0))
+
+    def snapshot(self):
+        """
+        return: {name: latest Sensors} (None for robots without a frame yet)
+        """
+        return {name: robot.stream.latest if robot.stream is not None else None
+                for name, robot in self}
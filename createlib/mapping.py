@@ -0,0 +1,278 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# Occupancy grid from the light bumpers and bumpers
+#
+# Every frame casts the six light bumper rays from the odometry pose: the
+# cells along a ray are marked free, and when the light bumper sees
+# something the cell at the estimated range is marked occupied. A bump marks
+# the cells at the front edge of the robot on its side. Cells hold log odds,
+# so each update is an addition, and all the cells of a frame are updated
+# with a few vectorized NumPy operations.
+#
+# The grid is stored as square chunks created the first time the robot
+# comes near them, so memory grows with the area explored (not the time
+# driven), and max_chunks caps it by dropping the chunks left alone longest.
+# The default cap, 1024 chunks of 64 x 64 cells, is 16 MB, about 1700 m^2
+# at 20 mm cells.
+#
+#   grid = OccupancyGrid(resolution=20)
+#   mapper = OccupancyMapper(robot, grid)   # updates on every stream frame
+#   image, origin = grid.to_array()         # dense log odds, (x, y) mm of image[0, 0]
+#
+# NumPy is optional, it is only needed by this module:
+#   pip install numpy
+##############################################
+
+import math
+import threading
+from collections import OrderedDict
+from createlib.packets import PACKET_100_LAYOUT, BITFIELD_MASKS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_OFFSETS = {name: offset for name, offset, _ in PACKET_100_LAYOUT}
+
+_MASK32 = 0xFFFFFFFF
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('NumPy is required for occupancy grids, install it with: pip install numpy')
+
+
+class OccupancyGrid(object):
+    """
+    Log odds occupancy grid made of chunks that are allocated on demand.
+    """
+
+    # (signal field, light_bumper bit, angle in degrees, counter clockwise from ahead)
+    LIGHT_BUMPERS = (
+        ('light_bumper_left', 'left', 65.0),
+        ('light_bumper_front_left', 'front_left', 35.0),
+        ('light_bumper_center_left', 'center_left', 10.0),
+        ('light_bumper_center_right', 'center_right', -10.0),
+        ('light_bumper_front_right', 'front_right', -35.0),
+        ('light_bumper_right', 'right', -65.0),
+    )
+    # angles of the front edge cells marked by bump_left and bump_right
+    BUMPS = (('bump_left', (15.0, 35.0, 55.0)), ('bump_right', (-15.0, -35.0, -55.0)))
+
+    def __init__(self, resolution=20, chunk_size=64, robot_radius=170, max_range=150,
+                 saturation=3000, l_occupied=0.85, l_free=-0.4, l_limit=4.0, max_chunks=1024):
+        """
+        resolution: cell size in mm
+        chunk_size: cells per chunk side, a power of two
+        robot_radius: distance from the center to the sensors and bumper in mm
+        max_range: how far a light bumper sees, in mm past the bumper
+        saturation: light bumper signal of an obstacle touching the bumper,
+                    the range of a detection scales linearly down to it
+        l_occupied, l_free: log odds added for a hit and for a cell seen free
+        l_limit: log odds are clamped to +-l_limit so the map can still change
+        max_chunks: keep at most this many chunks (the least recently updated
+                    are dropped), None for no limit
+        """
+        _require_numpy()
+        if chunk_size & (chunk_size - 1):
+            raise Exception(f"chunk_size must be a power of two, not {chunk_size}")
+        self.resolution = float(resolution)
+        self.chunk_size = chunk_size
+        self._chunk_bits = chunk_size.bit_length() - 1
+        self.robot_radius = robot_radius
+        self.max_range = max_range
+        self.saturation = saturation
+        self.l_occupied = l_occupied
+        self.l_free = l_free
+        self.l_limit = l_limit
+        self.max_chunks = max_chunks
+        self.chunks = OrderedDict()  # (cx, cy) -> float32 array [row y, column x], least recently updated first
+        self.updates = 0
+        self._lock = threading.Lock()
+
+        angles = np.radians([angle for _, _, angle in self.LIGHT_BUMPERS])
+        self._ray_angles = angles
+        # sample every half cell along a ray
+        self._ray_steps = np.arange(0.0, max_range + 1e-9, self.resolution / 2)
+
+    # ------------------------ Cells ----------------------------
+
+    def _keys(self, x, y):
+        """ Unique int64 cell keys of world points (mm) """
+        ix = np.floor(np.asarray(x) / self.resolution).astype(np.int64)
+        iy = np.floor(np.asarray(y) / self.resolution).astype(np.int64)
+        return np.unique((ix << 32) | (iy & _MASK32))
+
+    def _add(self, keys, delta):
+        if not len(keys):
+            return
+        ix = keys >> 32
+        iy = ((keys & _MASK32) ^ 0x80000000) - 0x80000000
+        bits = self._chunk_bits
+        chunk_keys = ((ix >> bits) << 32) | ((iy >> bits) & _MASK32)
+        local_x = ix & (self.chunk_size - 1)
+        local_y = iy & (self.chunk_size - 1)
+
+        if (chunk_keys == chunk_keys[0]).all():
+            # the usual case, every cell of the frame is in one chunk
+            groups = ((chunk_keys[0], slice(None)),)
+        else:
+            unique = np.unique(chunk_keys)
+            groups = ((key, chunk_keys == key) for key in unique)
+
+        for key, selection in groups:
+            key = int(key)
+            chunk = self._chunk(key >> 32, ((key & _MASK32) ^ 0x80000000) - 0x80000000)
+            rows, columns = local_y[selection], local_x[selection]
+            chunk[rows, columns] = np.clip(chunk[rows, columns] + delta, -self.l_limit, self.l_limit)
+
+    def _chunk(self, cx, cy):
+        chunk = self.chunks.get((cx, cy))
+        if chunk is None:
+            chunk = self.chunks[(cx, cy)] = np.zeros((self.chunk_size, self.chunk_size), np.float32)
+            if self.max_chunks is not None and len(self.chunks) > self.max_chunks:
+                self.chunks.popitem(last=False)
+        else:
+            self.chunks.move_to_end((cx, cy))
+        return chunk
+
+    # ------------------------ Updates ----------------------------
+
+    def integrate(self, pose, signals, detected, bumps=(False, False)):
+        """
+        One frame of sensor data.
+
+        pose: (x, y, theta) of the robot, mm and radians
+        signals: the six light bumper signals, in LIGHT_BUMPERS order
+        detected: the six light_bumper bits, in LIGHT_BUMPERS order
+        bumps: (bump_left, bump_right)
+        """
+        x, y, theta = pose
+        angles = theta + self._ray_angles
+        cos, sin = np.cos(angles), np.sin(angles)
+        signals = np.asarray(signals, dtype=np.float64)
+        detected = np.asarray(detected, dtype=bool)
+
+        # range past the bumper of each ray: a detection is closer the
+        # stronger the signal, a ray without one is free to its full range
+        ranges = np.where(detected, self.max_range * (1 - np.minimum(signals / self.saturation, 1)), self.max_range)
+
+        start_x = x + self.robot_radius * cos
+        start_y = y + self.robot_radius * sin
+        steps = self._ray_steps[None, :]
+        seen = steps < ranges[:, None]
+        free_x = (start_x[:, None] + cos[:, None] * steps)[seen]
+        free_y = (start_y[:, None] + sin[:, None] * steps)[seen]
+
+        hit_x = (start_x + cos * ranges)[detected]
+        hit_y = (start_y + sin * ranges)[detected]
+        for (_, bump_angles), bumped in zip(self.BUMPS, bumps):
+            if bumped:
+                a = theta + np.radians(bump_angles)
+                hit_x = np.concatenate((hit_x, x + (self.robot_radius + self.resolution / 2) * np.cos(a)))
+                hit_y = np.concatenate((hit_y, y + (self.robot_radius + self.resolution / 2) * np.sin(a)))
+
+        hits = self._keys(hit_x, hit_y)
+        free = np.setdiff1d(self._keys(free_x, free_y), hits, assume_unique=True)
+        with self._lock:
+            self._add(free, self.l_free)
+            self._add(hits, self.l_occupied)
+            self.updates += 1
+
+    def update_sensors(self, pose, sensors):
+        """
+        integrate() from a Sensors (or SensorSnapshot) frame
+        """
+        self.integrate(pose,
+                       [getattr(sensors, field) for field, _, _ in self.LIGHT_BUMPERS],
+                       [getattr(sensors.light_bumper, bit) for _, bit, _ in self.LIGHT_BUMPERS],
+                       (sensors.bumps_wheeldrops.bump_left, sensors.bumps_wheeldrops.bump_right))
+
+    # ------------------------ Queries ----------------------------
+
+    def log_odds(self, x, y):
+        """ Log odds of the cell at (x, y) mm, 0 (unknown) where nothing was seen """
+        ix, iy = int(x // self.resolution), int(y // self.resolution)
+        chunk = self.chunks.get((ix >> self._chunk_bits, iy >> self._chunk_bits))
+        if chunk is None:
+            return 0.0
+        mask = self.chunk_size - 1
+        return float(chunk[iy & mask, ix & mask])
+
+    def probability(self, x, y):
+        """ Probability that the cell at (x, y) mm is occupied """
+        return 1 - 1 / (1 + math.exp(self.log_odds(x, y)))
+
+    @property
+    def nbytes(self):
+        return sum(chunk.nbytes for chunk in self.chunks.values())
+
+    def to_array(self):
+        """
+        The chunks stitched into one dense log odds array, unknown cells are 0.
+
+        return: (array [row y, column x], (x, y) mm of the corner of cell [0, 0])
+        """
+        with self._lock:
+            if not self.chunks:
+                return np.zeros((0, 0), np.float32), (0.0, 0.0)
+            keys = list(self.chunks)
+            cx0 = min(cx for cx, _ in keys)
+            cy0 = min(cy for _, cy in keys)
+            width = max(cx for cx, _ in keys) - cx0 + 1
+            height = max(cy for _, cy in keys) - cy0 + 1
+            n = self.chunk_size
+            image = np.zeros((height * n, width * n), np.float32)
+            for (cx, cy), chunk in self.chunks.items():
+                image[(cy - cy0) * n:(cy - cy0 + 1) * n, (cx - cx0) * n:(cx - cx0 + 1) * n] = chunk
+        return image, (cx0 * n * self.resolution, cy0 * n * self.resolution)
+
+    def to_probability(self):
+        """ to_array() as occupancy probabilities (0.5 where unknown) """
+        image, origin = self.to_array()
+        return 1 - 1 / (1 + np.exp(image)), origin
+
+
+class OccupancyMapper(object):
+    """
+    Feeds an OccupancyGrid from a Create2's sensor stream, with the pose
+    from the robot's odometry (Create2.pose). Registered as a raw listener,
+    it reads the few bytes it needs without decoding the frame.
+    """
+
+    def __init__(self, robot, grid=None):
+        """
+        robot: a Create2, its stream is started if needed
+        grid: the OccupancyGrid to update, a new one if None
+        """
+        self.robot = robot
+        self.grid = grid if grid is not None else OccupancyGrid()
+        bumpers = self.grid.LIGHT_BUMPERS
+        self._signals = [_OFFSETS[field] for field, _, _ in bumpers]
+        self._light_bumper = _OFFSETS['light_bumper']
+        self._detect_masks = [BITFIELD_MASKS['light_bumper'][bit] for _, bit, _ in bumpers]
+        self._bumps = _OFFSETS['bumps_wheeldrops']
+        self._bump_masks = [BITFIELD_MASKS['bumps_wheeldrops'][bit] for bit, _ in self.grid.BUMPS]
+        self.stream = robot.start_stream()
+        self.stream.add_raw_listener(self)
+
+    def __call__(self, buf, offset, timestamp):
+        """
+        One frame, the signature matches SensorStream.add_raw_listener()
+        """
+        signals = [buf[offset + o] << 8 | buf[offset + o + 1] for o in self._signals]
+        light = buf[offset + self._light_bumper]
+        bumps = buf[offset + self._bumps]
+        self.grid.integrate(self.robot.pose, signals,
+                            [bool(light & m) for m in self._detect_masks],
+                            [bool(bumps & m) for m in self._bump_masks])
+
+    def close(self):
+        """
+        Stops updating the grid
+        """
+        self.stream.remove_raw_listener(self)
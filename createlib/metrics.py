@@ -0,0 +1,285 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# Latency histograms and counters
+#
+# Histogram keeps counts in log-linear buckets like an HdrHistogram: every
+# power of two range is split into the same number of linear sub buckets,
+# so any recorded value is known to within 1 / sub_buckets (1.6 % with the
+# default 64) while the bucket list stays a few hundred entries long for
+# values from 1 ns to hours. Recording is one bit_length() and one list
+# increment, cheap enough for the stream reader thread.
+#
+#   h = Histogram()
+#   h.record(time.monotonic_ns() - start)
+#   h.percentile(99)    # ns
+#
+# Metrics groups named counters, histograms and gauges (read from a
+# function when exported) and exports them in the Prometheus text format,
+# to a file for node_exporter's textfile collector or over HTTP:
+#
+#   robot.enable_metrics()
+#   robot.metrics.snapshot()
+#   robot.metrics.write_prometheus('/var/lib/node_exporter/create2.prom')
+#   robot.metrics.serve_prometheus(9101)
+##############################################
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Histogram(object):
+    """
+    Log-linear histogram of non-negative integer values (ie, nanoseconds)
+    """
+
+    def __init__(self, sub_bucket_bits=7):
+        """
+        sub_bucket_bits: values below 2**sub_bucket_bits are counted exactly,
+                         larger ones with 2**(sub_bucket_bits - 1) buckets
+                         per power of two
+        """
+        self.sub_bucket_bits = sub_bucket_bits
+        self._sub_count = 1 << sub_bucket_bits
+        self._half = self._sub_count >> 1
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * self._sub_count
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        if value < self._sub_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self._sub_count + (shift - 1) * self._half + (value >> shift) - self._half
+
+    def _lowest(self, index):
+        """ The smallest value counted in bucket index """
+        if index < self._sub_count:
+            return index
+        shift, sub = divmod(index - self._sub_count, self._half)
+        return (sub + self._half) << (shift + 1)
+
+    def _highest(self, index):
+        """ The largest value counted in bucket index """
+        return self._lowest(index + 1) - 1
+
+    def record(self, value):
+        """
+        Counts one value, negative values are counted as 0
+        """
+        value = int(value)
+        if value < 0:
+            value = 0
+        i = self._index(value)
+        counts = self.counts
+        if i >= len(counts):
+            counts.extend([0] * (i + 1 - len(counts)))
+        counts[i] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, p):
+        """
+        The value below which p percent of the recorded values fall (the
+        upper end of its bucket, capped at max), 0 if nothing was recorded
+        """
+        if not self.count:
+            return 0
+        rank = max(1, -(-self.count * p // 100))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self._highest(i), self.max)
+        return self.max
+
+    def buckets(self):
+        """
+        Yields (highest value, count) of the buckets that have counts
+        """
+        for i, n in enumerate(self.counts):
+            if n:
+                yield self._highest(i), n
+
+    def summary(self, scale=1):
+        """
+        dict of count, min, mean, p50, p90, p99, p99.9 and max, with the
+        values divided by scale (ie, 1e3 for microseconds from nanoseconds)
+        """
+        return {
+            'count': self.count,
+            'min': (self.min or 0) / scale,
+            'mean': self.mean / scale,
+            'p50': self.percentile(50) / scale,
+            'p90': self.percentile(90) / scale,
+            'p99': self.percentile(99) / scale,
+            'p99.9': self.percentile(99.9) / scale,
+            'max': (self.max or 0) / scale,
+        }
+
+    def __repr__(self):
+        return f"Histogram(count={self.count}, p50={self.percentile(50)}, p99={self.percentile(99)}, max={self.max})"
+
+
+class Metrics(object):
+    """
+    Named counters, histograms and gauges.
+
+    Counters live in the `counters` dict so hot paths update them with a
+    plain dict increment, a labeled counter is a dict of {label value: count}.
+    """
+
+    # Prometheus summary quantiles
+    QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+    def __init__(self, prefix='create2'):
+        """
+        prefix: prepended to every exported metric name
+        """
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self._help = {}
+        self._labels = {}
+
+    def counter(self, name, help='', label=None):
+        """
+        Registers a counter (if it does not exist yet) and returns its name.
+
+        label: label name for a counter broken down by label value, its
+               value in `counters` is then a dict
+        """
+        if name not in self.counters:
+            self.counters[name] = {} if label else 0
+            self._help[name] = help
+            self._labels[name] = label
+        return name
+
+    def histogram(self, name, help=''):
+        """
+        Registers a Histogram of nanoseconds (if it does not exist yet) and returns it
+        """
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+            self._help[name] = help
+        return self.histograms[name]
+
+    def gauge(self, name, function, help=''):
+        """
+        Registers a gauge, function() is called for its value when exported
+        """
+        self.gauges[name] = function
+        self._help[name] = help
+
+    def reset(self):
+        for name, value in self.counters.items():
+            if isinstance(value, dict):
+                value.clear()  # in place, instrumented code holds on to it
+            else:
+                self.counters[name] = 0
+        for h in self.histograms.values():
+            h.reset()
+
+    def snapshot(self):
+        """
+        dict of every counter, gauge and histogram summary (in microseconds)
+        """
+        snap = {}
+        for name, value in self.counters.items():
+            if isinstance(value, dict):
+                value = {_label(k): v for k, v in value.items()}
+            snap[name] = value
+        for name, function in self.gauges.items():
+            snap[name] = function()
+        for name, h in self.histograms.items():
+            snap[name + '_us'] = h.summary(1e3)
+        return snap
+
+    def to_prometheus(self):
+        """
+        Every metric in the Prometheus text exposition format. Counters get
+        a _total suffix, histograms are summaries in seconds.
+        """
+        lines = []
+        for name, value in list(self.counters.items()):
+            full = f"{self.prefix}_{name}_total"
+            lines.append(f"# HELP {full} {self._help.get(name, '')}")
+            lines.append(f"# TYPE {full} counter")
+            if isinstance(value, dict):
+                label = self._labels[name]
+                for key, count in list(value.items()):
+                    lines.append(f'{full}{{{label}="{_label(key)}"}} {count}')
+            else:
+                lines.append(f"{full} {value}")
+
+        for name, function in list(self.gauges.items()):
+            full = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full} {self._help.get(name, '')}")
+            lines.append(f"# TYPE {full} gauge")
+            lines.append(f"{full} {function()}")
+
+        for name, h in list(self.histograms.items()):
+            full = f"{self.prefix}_{name}_seconds"
+            lines.append(f"# HELP {full} {self._help.get(name, '')}")
+            lines.append(f"# TYPE {full} summary")
+            for q in self.QUANTILES:
+                lines.append(f'{full}{{quantile="{q}"}} {h.percentile(q * 100) / 1e9:.9f}')
+            lines.append(f"{full}_sum {h.total / 1e9:.9f}")
+            lines.append(f"{full}_count {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        Writes to_prometheus() to path, atomically so a collector never
+        reads a half written file
+        """
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp, path)
+
+    def serve_prometheus(self, port, host='127.0.0.1'):
+        """
+        Serves to_prometheus() over HTTP (any path) from a daemon thread.
+
+        return: the server, call its shutdown() to stop it
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="create2-metrics", daemon=True).start()
+        return server
+
+
+def _label(key):
+    # enum members (ie, OPCODES) are exported by name
+    return getattr(key, 'name', key)
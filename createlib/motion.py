@@ -0,0 +1,239 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# Closed loop motion primitives
+#
+# MotionController is a raw stream listener that keeps an Odometry up to
+# date from the encoder counts of every frame. A motion (drive a distance,
+# turn an angle) starts the wheels and returns a concurrent.futures.Future
+# right away; the reader thread checks the progress on every frame and
+# writes DRIVE_DIRECT 0, 0 on the frame closest to the target, so the
+# robot stops within one frame (15 ms of travel) of it.
+#
+#   robot.start_stream()
+#   done = robot.drive_distance(500, speed=200)   # mm, mm/s
+#   ...                                           # the caller is free
+#   done.result()                                 # mm actually travelled
+#   robot.turn(90).result()                       # degrees, counter clockwise
+#   robot.follow(waypoints).result()              # see createlib.pursuit
+##############################################
+
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future
+from createlib.odometry import Odometry
+from createlib.packets import PACKET_100_LAYOUT
+
+_OFFSETS = {name: offset for name, offset, _ in PACKET_100_LAYOUT}
+_LEFT = _OFFSETS['encoder_counts_left']
+_RIGHT = _OFFSETS['encoder_counts_right']
+
+
+class Motion(object):
+    """
+    One running motion primitive, see MotionController
+    """
+
+    def __init__(self, name, target, progress, future, deadline, scale=1, control=None):
+        """
+        target: how far to go, in the units of progress(), positive
+        progress: progress() -> how far it got so far, positive towards the target
+        deadline: time.monotonic_ns() to give up at, None for never
+        scale: multiplies progress() for the future's result (ie, radians to degrees)
+        control: control(pose) -> (left, right) wheel speeds for every frame,
+                 or None when done, instead of stopping at target
+        """
+        self.name = name
+        self.target = target
+        self.progress = progress
+        self.future = future
+        self.deadline = deadline
+        self.scale = scale
+        self.control = control
+        self.last = 0.0
+        self.command = None
+
+    @property
+    def result(self):
+        return self.progress() * self.scale
+
+    def __repr__(self):
+        return f"Motion({self.name!r}, target={self.target * self.scale})"
+
+
+class MotionController(object):
+    """
+    Odometry and the running motion of one robot, Create2 makes one and
+    registers it with its sensor stream.
+    """
+
+    # seconds a motion may take beyond the time it needs at its speed
+    TIMEOUT_MARGIN = 1.0
+
+    def __init__(self, robot):
+        self.robot = robot
+        self.odometry = Odometry()
+        self.active = None
+        self._lock = threading.Lock()
+
+    @property
+    def pose(self):
+        return self.odometry.pose
+
+    def __call__(self, buf, offset, timestamp):
+        """
+        One frame, the signature matches SensorStream.add_raw_listener()
+        """
+        left = buf[offset + _LEFT] << 8 | buf[offset + _LEFT + 1]
+        right = buf[offset + _RIGHT] << 8 | buf[offset + _RIGHT + 1]
+        self.odometry.update(left, right)
+
+        motion = self.active
+        if motion is None:
+            return
+
+        if motion.control is not None:
+            command = motion.control(self.odometry.pose)
+            if command is None:
+                self._finish(motion)
+            elif motion.deadline is not None and timestamp > motion.deadline:
+                self._finish(motion, Exception(f"{motion.name} did not finish in time, stopped "
+                                               f"after {motion.result:.1f} of {motion.target * motion.scale:.1f}"))
+            elif command != motion.command:
+                motion.command = command
+                self.robot.drive_direct(*command)
+            return
+
+        done = motion.progress()
+        step = done - motion.last
+        motion.last = done
+        # stop on the frame that ends closest to the target: now, if going
+        # on for another frame like the last one would overshoot by more
+        if motion.target - done <= step / 2:
+            self._finish(motion)
+        elif motion.deadline is not None and timestamp > motion.deadline:
+            self._finish(motion, Exception(f"{motion.name} did not finish in time, stopped "
+                                           f"after {motion.result:.1f} of {motion.target * motion.scale:.1f}"))
+
+    def _finish(self, motion, error=None):
+        with self._lock:
+            if self.active is not motion:
+                return
+            self.active = None
+        try:
+            self.robot.drive_direct(0, 0)
+        except Exception as e:
+            logging.error(f"Could not stop the robot after {motion.name}: {e}")
+            error = error or e
+        if error is None:
+            motion.future.set_result(motion.result)
+        else:
+            motion.future.set_exception(error)
+
+    def _start(self, name, target, progress, velocities, speed, scale=1, timeout=None, control=None):
+        if not self.robot.streaming:
+            self.robot.start_stream()
+        self.cancel()
+
+        future = Future()
+        future.set_running_or_notify_cancel()
+        if target <= 0:
+            future.set_result(0.0)
+            return future
+
+        if timeout is None:
+            timeout = target / speed + self.TIMEOUT_MARGIN
+        deadline = time.monotonic_ns() + int(timeout * 1e9)
+        motion = Motion(name, target, progress, future, deadline, scale, control)
+        with self._lock:
+            self.active = motion
+        if velocities is not None:
+            self.robot.drive_direct(*velocities)
+        return future
+
+    def drive_distance(self, mm, speed=200, timeout=None):
+        """
+        Drives straight for mm millimeters (negative is backwards).
+
+        speed: wheel speed, mm/sec [0, 500]
+        timeout: seconds before giving up, by default the time the distance
+                 takes at speed plus TIMEOUT_MARGIN
+        return: a Future, its result is the signed distance travelled in mm
+        """
+        speed = min(abs(speed), 500)
+        if not speed:
+            raise Exception('drive_distance() needs a speed above 0')
+        sign = 1 if mm >= 0 else -1
+        start = self.odometry.distance
+
+        def progress():
+            return (self.odometry.distance - start) * sign
+
+        return self._start('drive_distance', abs(mm), progress, (sign * speed, sign * speed),
+                           speed, sign, timeout)
+
+    def turn(self, deg, speed=100, timeout=None):
+        """
+        Turns in place by deg degrees, counter clockwise is positive.
+
+        speed: wheel speed, mm/sec [0, 500]
+        timeout: seconds before giving up, see drive_distance()
+        return: a Future, its result is the signed angle turned in degrees
+        """
+        speed = min(abs(speed), 500)
+        if not speed:
+            raise Exception('turn() needs a speed above 0')
+        sign = 1 if deg >= 0 else -1
+        start = self.odometry.rotation
+        target = math.radians(abs(deg))
+
+        def progress():
+            return (self.odometry.rotation - start) * sign
+
+        # the wheels move on a circle of diameter wheel_base, at speed mm/sec
+        angular_speed = 2 * speed / self.odometry.wheel_base
+        return self._start('turn', target, progress, (-sign * speed, sign * speed),
+                           angular_speed, sign * 180 / math.pi, timeout)
+
+    def follow(self, waypoints, speed=200, lookahead=150, relative=False, timeout=None, **kwargs):
+        """
+        Follows a path with a PurePursuit controller, steering on every frame.
+
+        waypoints: (x, y) points in mm, a list or an N x 2 NumPy array, in the
+                   odometry frame (see pose) or, if relative, with x ahead
+                   of and y to the left of the robot as it is now
+        speed, lookahead: see PurePursuit, other keyword arguments go to it too
+        timeout: seconds before giving up, by default twice the time the path
+                 takes at speed plus TIMEOUT_MARGIN
+        return: a Future, its result is how far along the path (mm) the robot got
+        """
+        from createlib.pursuit import PurePursuit
+
+        if relative:
+            x0, y0, theta = self.odometry.pose
+            cos, sin = math.cos(theta), math.sin(theta)
+            if hasattr(waypoints, 'tolist'):
+                waypoints = waypoints.tolist()
+            waypoints = [(x0 + cos * x - sin * y, y0 + sin * x + cos * y) for x, y in waypoints]
+
+        pursuit = PurePursuit(waypoints, speed, lookahead, self.odometry.wheel_base, **kwargs)
+        if timeout is None:
+            timeout = 2 * pursuit.length / max(min(abs(speed), 500), 1) + self.TIMEOUT_MARGIN
+
+        def progress():
+            return pursuit.progress
+
+        return self._start('follow', pursuit.length, progress, None, 1, timeout=timeout,
+                           control=pursuit.command)
+
+    def cancel(self, reason='cancelled'):
+        """
+        Stops the running motion, its future raises an Exception with reason
+        """
+        motion = self.active
+        if motion is not None:
+            self._finish(motion, Exception(f"{motion.name} {reason} after {motion.result:.1f}"))
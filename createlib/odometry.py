@@ -0,0 +1,90 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# Wheel odometry from the encoder counts (packets 43 and 44)
+#
+# The encoder counts are 16 bit rolling counters, so only the difference
+# between two frames means anything. Each update is a handful of float
+# operations, cheap enough to run on every streamed frame:
+#
+#   robot.start_stream().add_listener(odom.update_sensors)
+##############################################
+
+import math
+from collections import namedtuple
+from createlib.create_oi import ROBOT
+
+# x, y in mm, theta in radians (counter clockwise, 0 along the starting heading)
+Pose = namedtuple('Pose', ['x', 'y', 'theta'])
+
+
+def encoder_delta(new, old):
+    """
+    Signed change between two 16 bit encoder readings, handling the wrap
+    around 0 / 65535 in either direction.
+    """
+    return ((new - old + 0x8000) & 0xFFFF) - 0x8000
+
+
+class Odometry(object):
+    """
+    Integrates an (x, y, theta) pose from the wheel encoder counts.
+    """
+
+    def __init__(self, wheel_base=ROBOT.WHEEL_BASE, tick_to_distance=ROBOT.TICK_TO_DISTANCE):
+        """
+        wheel_base: distance between the wheels in mm
+        tick_to_distance: mm travelled per encoder tick
+        """
+        self.wheel_base = float(wheel_base)
+        self.tick_to_distance = float(tick_to_distance)
+        self.reset()
+
+    def reset(self, x=0.0, y=0.0, theta=0.0):
+        """
+        Sets the pose. The next update only records the encoder counts.
+        """
+        self.pose = Pose(x, y, theta)
+        self.distance = 0.0  # signed mm travelled by the center of the robot
+        self.rotation = 0.0  # signed radians turned, counter clockwise, not wrapped
+        self.updates = 0
+        self._left = None
+        self._right = None
+
+    def update(self, left_counts, right_counts):
+        """
+        Advances the pose with a new pair of encoder readings.
+
+        return: the new Pose
+        """
+        if self._left is None:
+            self._left, self._right = left_counts, right_counts
+            return self.pose
+
+        dl = encoder_delta(left_counts, self._left) * self.tick_to_distance
+        dr = encoder_delta(right_counts, self._right) * self.tick_to_distance
+        self._left, self._right = left_counts, right_counts
+
+        d = (dl + dr) / 2
+        dtheta = (dr - dl) / self.wheel_base
+
+        # integrate along the mid-point heading
+        x, y, theta = self.pose
+        heading = theta + dtheta / 2
+        x += d * math.cos(heading)
+        y += d * math.sin(heading)
+        theta = (theta + dtheta + math.pi) % (2 * math.pi) - math.pi
+
+        self.pose = Pose(x, y, theta)
+        self.distance += d
+        self.rotation += dtheta
+        self.updates += 1
+        return self.pose
+
+    def update_sensors(self, sensors):
+        """
+        update() from a Sensors frame, usable as a SensorStream listener
+        """
+        return self.update(sensors.encoder_counts_left, sensors.encoder_counts_right)
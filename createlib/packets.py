@@ -8,11 +8,15 @@
 ##############################################
 # Changelog:
 #   + decode() function
+#   + single pass packet 100 decoder with bitfield lookup tables
+#   + per packet format table and cached QUERY_LIST decoders
+#   + SensorSnapshot, a lazily decoded packet 100
 
 
 from struct import Struct
 from collections import namedtuple
-from createlib.create_oi import WHEEL_OVERCURRENT, BUMPS_WHEEL_DROPS, BUTTONS, CHARGE_SOURCE, LIGHT_BUMPER, STASIS
+from functools import lru_cache
+from createlib.create_oi import WHEEL_OVERCURRENT, BUMPS_WHEEL_DROPS, BUTTONS, CHARGE_SOURCE, LIGHT_BUMPER, STASIS, SENSOR_PACKETS
 
 def decode(format, data):
 	""" Wrapper to decode various formats """
@@ -89,13 +93,10 @@ Sensors = namedtuple('Sensors', [
     'statis'
 ])
 
-def SensorPacketDecoder(data):
+def _reference_sensor_packet_decoder(data):
     """
-    This function decodes a Create 2 packet id 100  with 
-    packet size (80) containging packets 7-58 and returns 
-    a Sensor object, which is a namedtuple. 
-
-    The Sensor class holds all sensor values for the Create 2.
+    Field-by-field decoder for packet 100, kept as the reference the
+    SensorPacketDecoder is checked and benchmarked against.
     """
 
     if len(data) != 80:
@@ -220,4 +221,364 @@ def SensorPacketDecoder(data):
         stasis                                  # 58 (nt)
     )
 
-    return sensors
\ No newline at end of file
+    return sensors
+
+
+# Packet 100 in a single unpack (OI pg 25-32). Packets 16, 32 and 33 are
+# unused and skipped with pad bytes, so the 80 bytes map onto 52 values.
+PACKET_100 = Struct(
+    '>'
+    'B'         # 7      bumps and wheel drops (nt)
+    '6?'        # 8-13   wall, cliffs, virtual wall
+    'B'         # 14     wheel overcurrents (nt)
+    'b'         # 15     dirt detect
+    'x'         # 16     unused
+    'B'         # 17     ir opcode
+    'B'         # 18     buttons (nt)
+    '2h'        # 19-20  distance, angle
+    'B'         # 21     charge state
+    'H'         # 22     voltage
+    'h'         # 23     current
+    'b'         # 24     temperature
+    '7H'        # 25-31  battery charge/capacity, wall and cliff signals
+    '3x'        # 32-33  unused
+    'B'         # 34     charging sources (nt)
+    '2B'        # 35-36  oi mode, song number
+    '?'         # 37     song playing
+    'B'         # 38     oi stream num packets
+    '4h'        # 39-42  velocity, radius, velocity right/left
+    '2H'        # 43-44  encoder counts
+    'B'         # 45     light bumper (nt)
+    '6H'        # 46-51  light bump signals
+    '2B'        # 52-53  ir opcode left/right
+    '4h'        # 54-57  motor currents
+    'B'         # 58     stasis (nt)
+)
+
+# Every possible value of a bitfield byte decoded once up front. The
+# namedtuples are immutable, so the same instance is shared by every frame.
+BUMPS_WHEEL_DROPS_TABLE = tuple(BumpsAndWheelDrop(
+    bool(d & BUMPS_WHEEL_DROPS.WHEEL_DROP_LEFT),
+    bool(d & BUMPS_WHEEL_DROPS.WHEEL_DROP_RIGHT),
+    bool(d & BUMPS_WHEEL_DROPS.BUMP_LEFT),
+    bool(d & BUMPS_WHEEL_DROPS.BUMP_RIGHT)) for d in range(256))
+
+WHEEL_OVERCURRENTS_TABLE = tuple(WheelOvercurrents(
+    bool(d & WHEEL_OVERCURRENT.LEFT_WHEEL),
+    bool(d & WHEEL_OVERCURRENT.RIGHT_WHEEL),
+    bool(d & WHEEL_OVERCURRENT.MAIN_BRUSH),
+    bool(d & WHEEL_OVERCURRENT.SIDE_BRUSH)) for d in range(256))
+
+BUTTONS_TABLE = tuple(Buttons(
+    bool(d & BUTTONS.CLOCK),
+    bool(d & BUTTONS.SCHEDULE),
+    bool(d & BUTTONS.DAY),
+    bool(d & BUTTONS.HOUR),
+    bool(d & BUTTONS.MINUTE),
+    bool(d & BUTTONS.DOCK),
+    bool(d & BUTTONS.SPOT),
+    bool(d & BUTTONS.CLEAN)) for d in range(256))
+
+CHARGING_SOURCES_TABLE = tuple(ChargingSources(
+    bool(d & CHARGE_SOURCE.HOME_BASE),
+    bool(d & CHARGE_SOURCE.INTERNAL)) for d in range(256))
+
+LIGHT_BUMPER_TABLE = tuple(LightBumper(
+    bool(d & LIGHT_BUMPER.RIGHT),
+    bool(d & LIGHT_BUMPER.FRONT_RIGHT),
+    bool(d & LIGHT_BUMPER.CENTER_RIGHT),
+    bool(d & LIGHT_BUMPER.CENTER_LEFT),
+    bool(d & LIGHT_BUMPER.FRONT_LEFT),
+    bool(d & LIGHT_BUMPER.LEFT)) for d in range(256))
+
+STASIS_TABLE = tuple(Stasis(
+    bool(d & STASIS.DISABLED),
+    bool(d & STASIS.TOGGLING)) for d in range(256))
+
+
+def SensorPacketDecoder(data, offset=None):
+    """
+    This function decodes a Create 2 packet id 100  with 
+    packet size (80) containging packets 7-58 and returns 
+    a Sensor object, which is a namedtuple. 
+
+    The Sensor class holds all sensor values for the Create 2.
+
+    offset: decode the 80 bytes starting at this offset of a larger
+            buffer (ie, a ReceiveBuffer) in place instead of a slice
+    """
+
+    if offset is None:
+        if len(data) != 80:
+            raise Exception(f"Sensor data not 80 bytes long, it is: {len(data)} bytes")
+        v = PACKET_100.unpack(data)
+    else:
+        if len(data) - offset < 80:
+            raise Exception(f"Sensor data not 80 bytes long, it is: {len(data) - offset} bytes")
+        v = PACKET_100.unpack_from(data, offset)
+
+    return Sensors(
+        BUMPS_WHEEL_DROPS_TABLE[v[0]],
+        v[1], v[2], v[3], v[4], v[5], v[6],
+        WHEEL_OVERCURRENTS_TABLE[v[7]],
+        v[8], v[9],
+        BUTTONS_TABLE[v[10]],
+        v[11], v[12], v[13], v[14], v[15], v[16], v[17], v[18],
+        v[19], v[20], v[21], v[22], v[23],
+        CHARGING_SOURCES_TABLE[v[24]],
+        v[25], v[26], v[27], v[28], v[29], v[30], v[31], v[32],
+        v[33], v[34],
+        LIGHT_BUMPER_TABLE[v[35]],
+        v[36], v[37], v[38], v[39], v[40], v[41], v[42], v[43],
+        v[44], v[45], v[46], v[47],
+        STASIS_TABLE[v[48]]
+    )
+
+
+# Struct format and lookup table (for bitfields) of every single sensor
+# packet, keyed by packet id. The Sensors fields are in packet id order,
+# so the field names line up with SENSOR_PACKETS.
+_PACKET_FORMATS = {
+    SENSOR_PACKETS.BUMPS_AND_WHEELDROPS:     ('B', BUMPS_WHEEL_DROPS_TABLE),
+    SENSOR_PACKETS.WALL:                     ('?', None),
+    SENSOR_PACKETS.CLIFF_LEFT:               ('?', None),
+    SENSOR_PACKETS.CLIFF_FRONT_LEFT:         ('?', None),
+    SENSOR_PACKETS.CLIFF_FRONT_RIGHT:        ('?', None),
+    SENSOR_PACKETS.CLIFF_RIGHT:              ('?', None),
+    SENSOR_PACKETS.VIRTUAL_WALL:             ('?', None),
+    SENSOR_PACKETS.WHEEL_OVERCURRENTS:       ('B', WHEEL_OVERCURRENTS_TABLE),
+    SENSOR_PACKETS.DIRT_DETECT:              ('b', None),
+    SENSOR_PACKETS.IR_OPCODE:                ('B', None),
+    SENSOR_PACKETS.BUTTONS:                  ('B', BUTTONS_TABLE),
+    SENSOR_PACKETS.DISTANCE:                 ('h', None),
+    SENSOR_PACKETS.ANGLE:                    ('h', None),
+    SENSOR_PACKETS.CHARGE_STATE:             ('B', None),
+    SENSOR_PACKETS.VOLTAGE:                  ('H', None),
+    SENSOR_PACKETS.CURRENT:                  ('h', None),
+    SENSOR_PACKETS.TEMPERATURE:              ('b', None),
+    SENSOR_PACKETS.BATTERY_CHARGE:           ('H', None),
+    SENSOR_PACKETS.BATTERY_CAPACITY:         ('H', None),
+    SENSOR_PACKETS.WALL_SIGNAL:              ('H', None),
+    SENSOR_PACKETS.CLIFF_LEFT_SIGNAL:        ('H', None),
+    SENSOR_PACKETS.CLIFF_FRONT_LEFT_SIGNAL:  ('H', None),
+    SENSOR_PACKETS.CLIFF_FRONT_RIGHT_SIGNAL: ('H', None),
+    SENSOR_PACKETS.CLIFF_RIGHT_SIGNAL:       ('H', None),
+    SENSOR_PACKETS.CHARGING_SOURCES:         ('B', CHARGING_SOURCES_TABLE),
+    SENSOR_PACKETS.OI_MODE:                  ('B', None),
+    SENSOR_PACKETS.SONG_NUMBER:              ('B', None),
+    SENSOR_PACKETS.SONG_PLAYING:             ('?', None),
+    SENSOR_PACKETS.OI_STREAM_PACKET_SIZE:    ('B', None),
+    SENSOR_PACKETS.VELOCITY:                 ('h', None),
+    SENSOR_PACKETS.TURN_RADIUS:              ('h', None),
+    SENSOR_PACKETS.VELOCITY_RIGHT:           ('h', None),
+    SENSOR_PACKETS.VELOCITY_LEFT:            ('h', None),
+    SENSOR_PACKETS.ENCODER_LEFT:             ('H', None),
+    SENSOR_PACKETS.ENCODER_RIGHT:            ('H', None),
+    SENSOR_PACKETS.LIGHT_BUMPER:             ('B', LIGHT_BUMPER_TABLE),
+    SENSOR_PACKETS.LIGHT_BUMP_LEFT:          ('H', None),
+    SENSOR_PACKETS.LIGHT_BUMP_FRONT_LEFT:    ('H', None),
+    SENSOR_PACKETS.LIGHT_BUMP_CENTER_LEFT:   ('H', None),
+    SENSOR_PACKETS.LIGHT_BUMP_CENTER_RIGHT:  ('H', None),
+    SENSOR_PACKETS.LIGHT_BUMP_FRONT_RIGHT:   ('H', None),
+    SENSOR_PACKETS.LIGHT_BUMP_RIGHT:         ('H', None),
+    SENSOR_PACKETS.IR_OPCODE_LEFT:           ('B', None),
+    SENSOR_PACKETS.IR_OPCODE_RIGHT:          ('B', None),
+    SENSOR_PACKETS.LEFT_MOTOR_CURRENT:       ('h', None),
+    SENSOR_PACKETS.RIGHT_MOTOR_CURRENT:      ('h', None),
+    SENSOR_PACKETS.MAIN_BRUSH_CURRENT:       ('h', None),
+    SENSOR_PACKETS.SIDE_BRUSH_CURRENT:       ('h', None),
+    SENSOR_PACKETS.STASIS:                   ('B', STASIS_TABLE),
+}
+
+# packet id -> Sensors field name
+PACKET_FIELDS = dict(zip(SENSOR_PACKETS, Sensors._fields))
+
+# packet id -> number of data bytes the robot sends for it
+PACKET_SIZES = {pid: Struct(fmt).size for pid, (fmt, _) in _PACKET_FORMATS.items()}
+
+# Sensors field name -> lookup table, for the fields that are bitfields
+BITFIELD_TABLES = {PACKET_FIELDS[pid]: table for pid, (_, table) in _PACKET_FORMATS.items() if table is not None}
+
+
+def _bit_masks(table):
+    # the entry for 1 << b has exactly the field of bit b set
+    return {field: 1 << b for b in range(8) for field, set_ in zip(table[0]._fields, table[1 << b]) if set_}
+
+# Sensors field name -> {bit field name: mask}, ie, BITFIELD_MASKS['bumps_wheeldrops']['bump_left'] == 0x02
+BITFIELD_MASKS = {field: _bit_masks(table) for field, table in BITFIELD_TABLES.items()}
+
+# unused packets inside packet 100 and their sizes
+_UNUSED_PACKETS = {16: 1, 32: 1, 33: 2}
+
+
+def _packet_100_layout():
+    layout = []
+    offset = 0
+    for pid in range(7, 59):
+        if pid in _UNUSED_PACKETS:
+            offset += _UNUSED_PACKETS[pid]
+            continue
+        fmt = _PACKET_FORMATS[pid][0]
+        layout.append((PACKET_FIELDS[pid], offset, fmt))
+        offset += PACKET_SIZES[pid]
+    assert offset == PACKET_100.size
+    return tuple(layout)
+
+# (Sensors field name, byte offset in packet 100, struct format) in packet order
+PACKET_100_LAYOUT = _packet_100_layout()
+
+
+class _LazyField(object):
+    """
+    A SensorSnapshot field, decoded from the packet bytes on first access
+    """
+
+    __slots__ = ('index', 'unpack_from', 'offset', 'table')
+
+    def __init__(self, index, fmt, offset, table):
+        self.index = index
+        self.unpack_from = Struct('>' + fmt).unpack_from
+        self.offset = offset
+        self.table = table
+
+    def __get__(self, snapshot, cls):
+        if snapshot is None:
+            return self
+        values = snapshot._values
+        value = values[self.index]
+        if value is None:
+            value = self.unpack_from(snapshot._data, self.offset)[0]
+            if self.table is not None:
+                value = self.table[value]
+            values[self.index] = value
+        return value
+
+    def __set__(self, snapshot, value):
+        raise AttributeError("can't set attribute")
+
+
+class SensorSnapshot(object):
+    """
+    A packet 100 that decodes a field the first time it is read and keeps
+    the value. Drop-in for a Sensors namedtuple (attributes, _fields,
+    _asdict(), indexing, iteration, ==) for consumers that read only a
+    few fields of every frame.
+
+        sensors = SensorSnapshot(data)
+        sensors.bumps_wheeldrops.bump_left   # only this byte is decoded
+    """
+
+    __slots__ = ('_data', '_values')
+
+    _fields = Sensors._fields
+
+    def __init__(self, data, offset=None):
+        """
+        data: the 80 byte packet, or a larger buffer (ie, a ReceiveBuffer)
+              holding it at offset, the 80 bytes are copied
+        """
+        if offset is None:
+            if len(data) != 80:
+                raise Exception(f"Sensor data not 80 bytes long, it is: {len(data)} bytes")
+            self._data = bytes(data)
+        else:
+            if len(data) - offset < 80:
+                raise Exception(f"Sensor data not 80 bytes long, it is: {len(data) - offset} bytes")
+            self._data = bytes(data[offset:offset + 80])
+        self._values = [None] * len(Sensors._fields)
+
+    @property
+    def raw(self):
+        """ The 80 packet bytes """
+        return self._data
+
+    def to_sensors(self):
+        """ Every field decoded, as a Sensors namedtuple """
+        return SensorPacketDecoder(self._data)
+
+    def _asdict(self):
+        # one full decode beats decoding most fields one by one
+        return self.to_sensors()._asdict()
+
+    def _replace(self, **kwargs):
+        return self.to_sensors()._replace(**kwargs)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __iter__(self):
+        return iter(self.to_sensors())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(getattr(self, name) for name in self._fields[index])
+        return getattr(self, self._fields[index])
+
+    def __eq__(self, other):
+        if isinstance(other, SensorSnapshot):
+            return self._data == other._data
+        if isinstance(other, tuple):
+            return self.to_sensors() == other
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.to_sensors())
+
+    def __reduce__(self):
+        return (SensorSnapshot, (self._data,))
+
+    def __repr__(self):
+        return repr(self.to_sensors())
+
+
+for _index, (_name, _offset, _fmt) in enumerate(PACKET_100_LAYOUT):
+    setattr(SensorSnapshot, _name, _LazyField(_index, _fmt, _offset, BITFIELD_TABLES.get(_name)))
+del _index, _name, _offset, _fmt
+
+
+class SensorQuery(object):
+    """
+    Decoder for the reply to a QUERY_LIST (opcode 149) request of a fixed
+    list of packet ids. Use sensor_query() to get a cached instance.
+
+    packet_ids: the requested packet ids, in request order
+    size: the number of bytes the robot replies with
+    result: the namedtuple class returned by decode()
+    """
+
+    def __init__(self, packet_ids):
+        for pid in packet_ids:
+            if pid not in _PACKET_FORMATS:
+                raise Exception(f"Unsupported sensor packet id: {pid}")
+        if len(set(packet_ids)) != len(packet_ids):
+            raise Exception(f"Duplicate sensor packet ids in query: {packet_ids}")
+
+        self.packet_ids = tuple(SENSOR_PACKETS(pid) for pid in packet_ids)
+        self.struct = Struct('>' + ''.join(_PACKET_FORMATS[pid][0] for pid in self.packet_ids))
+        self.size = self.struct.size
+        self.result = namedtuple('SensorQueryResult', [PACKET_FIELDS[pid] for pid in self.packet_ids])
+        self._bitfields = tuple((i, _PACKET_FORMATS[pid][1])
+                                for i, pid in enumerate(self.packet_ids)
+                                if _PACKET_FORMATS[pid][1] is not None)
+
+    def decode(self, data):
+        """
+        Decodes the reply bytes into a SensorQueryResult namedtuple.
+        """
+        if len(data) != self.size:
+            raise Exception(f"Sensor data not {self.size} bytes long, it is: {len(data)} bytes")
+
+        values = self.struct.unpack(data)
+        if self._bitfields:
+            values = list(values)
+            for i, table in self._bitfields:
+                values[i] = table[values[i]]
+        return self.result._make(values)
+
+
+@lru_cache(maxsize=None)
+def sensor_query(packet_ids):
+    """
+    Returns the (cached) SensorQuery for a tuple of packet ids.
+    """
+    return SensorQuery(packet_ids)
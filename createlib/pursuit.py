@@ -0,0 +1,127 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# Pure pursuit waypoint follower
+#
+# The path's cumulative arc length is computed once, so finding the look
+# ahead point is a bisect (O(log n)) and tracking the robot's progress only
+# moves forward a segment at a time, which keeps every control tick cheap
+# on paths with tens of thousands of points. Each tick steers along the
+# arc through the look ahead point and returns DRIVE_DIRECT wheel speeds
+# clamped to [-500, 500] mm/sec.
+#
+#   done = robot.follow([(0, 0), (500, 0), (500, 500)], speed=200)
+#   done.result()    # mm of path covered
+##############################################
+
+import bisect
+import math
+from itertools import accumulate
+
+
+class PurePursuit(object):
+    """
+    Steers a differential drive robot along a polyline of waypoints.
+    """
+
+    def __init__(self, waypoints, speed=200, lookahead=150, wheel_base=235, tolerance=10, min_speed=40):
+        """
+        waypoints: (x, y) points in mm, a list or an N x 2 NumPy array
+        speed: cruise speed of the robot's center, mm/sec
+        lookahead: distance along the path to steer towards, mm
+        wheel_base: distance between the wheels, mm
+        tolerance: distance to the last waypoint that counts as arrived, mm
+        min_speed: the speed never drops below this while slowing down for the end
+        """
+        if hasattr(waypoints, 'tolist'):
+            waypoints = waypoints.tolist()
+        points = [(float(x), float(y)) for x, y in waypoints]
+        # repeated points would make zero length segments
+        self.points = [p for i, p in enumerate(points) if i == 0 or p != points[i - 1]]
+        if len(self.points) < 2:
+            raise Exception('A path needs at least two distinct waypoints')
+        if not lookahead > 0:
+            raise Exception(f"lookahead must be above 0 mm, not {lookahead}")
+
+        # s[i] is the arc length from the start to points[i]
+        self.s = list(accumulate(
+            (math.hypot(bx - ax, by - ay) for (ax, ay), (bx, by) in zip(self.points, self.points[1:])),
+            initial=0.0))
+        self.length = self.s[-1]
+
+        self.speed = speed
+        self.lookahead = lookahead
+        self.half_base = wheel_base / 2
+        self.tolerance = tolerance
+        self.min_speed = min_speed
+        self.segment = 0      # segment the robot was last projected onto
+        self.progress = 0.0   # arc length of that projection
+
+    def _project(self, x, y):
+        """
+        Moves self.segment forward to the segment the robot is beside and
+        returns the arc length of its projection onto the path.
+        """
+        points = self.points
+        last = len(points) - 2
+        i = self.segment
+        while True:
+            (ax, ay), (bx, by) = points[i], points[i + 1]
+            dx, dy = bx - ax, by - ay
+            t = ((x - ax) * dx + (y - ay) * dy) / (dx * dx + dy * dy)
+            if t < 1 or i == last:
+                break
+            i += 1
+        self.segment = i
+        return self.s[i] + max(0.0, min(t, 1.0)) * (self.s[i + 1] - self.s[i])
+
+    def point_at(self, s):
+        """
+        The (x, y) point at arc length s along the path
+        """
+        if s >= self.length:
+            return self.points[-1]
+        i = max(bisect.bisect_right(self.s, s) - 1, 0)
+        (ax, ay), (bx, by) = self.points[i], self.points[i + 1]
+        t = (s - self.s[i]) / (self.s[i + 1] - self.s[i])
+        return ax + t * (bx - ax), ay + t * (by - ay)
+
+    def command(self, pose):
+        """
+        Wheel speeds for one control tick.
+
+        pose: (x, y, theta) of the robot, mm and radians
+        return: (left, right) mm/sec, or None once the end is reached
+        """
+        x, y, theta = pose
+        self.progress = max(self.progress, self._project(x, y))
+
+        ex, ey = self.points[-1]
+        to_end = math.hypot(ex - x, ey - y)
+        if to_end <= self.tolerance or (self.progress >= self.length and to_end <= self.lookahead / 2):
+            return None
+
+        # look ahead point in the robot's frame
+        gx, gy = self.point_at(self.progress + self.lookahead)
+        dx, dy = gx - x, gy - y
+        cos, sin = math.cos(theta), math.sin(theta)
+        local_x = cos * dx + sin * dy
+        local_y = -sin * dx + cos * dy
+        distance_sq = local_x * local_x + local_y * local_y
+        curvature = 2 * local_y / distance_sq if distance_sq else 0.0
+
+        remaining = self.length - self.progress
+        speed = max(self.min_speed, min(self.speed, self.speed * remaining / self.lookahead))
+        if local_x < 0:
+            speed = self.min_speed  # the path is behind, turn around slowly
+
+        left = speed * (1 - curvature * self.half_base)
+        right = speed * (1 + curvature * self.half_base)
+
+        # keep the turn radius when a wheel would go past the limit
+        peak = max(abs(left), abs(right))
+        if peak > 500:
+            left, right = left * 500 / peak, right * 500 / peak
+        return max(-500, min(500, int(left))), max(-500, min(500, int(right)))
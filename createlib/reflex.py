@@ -0,0 +1,166 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# Safety reflexes
+#
+# A reflex is a rule checked on the raw bytes of every stream frame, in
+# the stream reader thread, before the frame is even decoded: when any of
+# its trigger bits is set the command is written to the robot right there,
+# with no thread hop and no sleep. By default this is DRIVE_DIRECT 0, 0:
+#
+#   robot.start_stream()
+#   robot.reflexes.add('stop', Reflexes.CLIFFS + Reflexes.WHEEL_DROPS)
+#   ...
+#   robot.reflexes.reaction_times.summary(1e3)   # frame read -> command written, us
+#
+# Triggers are sensor names like in createlib.events: a bit of a bitfield
+# ('bumps_wheeldrops.bump_left'), a whole bitfield ('light_bumper', set
+# when any bit is) or a 1 byte field ('cliff_left').
+#
+# A reflex that writes a command also cancels the robot's running motion
+# (drive_distance(), turn(), follow()), whose controller would otherwise
+# drive on over the reflex's stop later in the same frame.
+##############################################
+
+import logging
+import threading
+import time
+from createlib.create_oi import OPCODES
+from createlib.events import _FIELDS
+from createlib.packets import BITFIELD_MASKS
+from createlib.metrics import Histogram
+
+
+class Reflex(object):
+    """
+    One rule, see Reflexes.add()
+    """
+
+    __slots__ = ('name', 'triggers', 'masks', 'opcode', 'data', 'callback', 'repeat', 'triggered', 'fired')
+
+    def __init__(self, name, triggers, masks, opcode, data, callback, repeat):
+        self.name = name
+        self.triggers = triggers
+        self.masks = masks          # ((byte offset, mask), ...)
+        self.opcode = opcode
+        self.data = data
+        self.callback = callback
+        self.repeat = repeat
+        self.triggered = False      # the condition held on the last frame
+        self.fired = 0
+
+    def __repr__(self):
+        return f"Reflex({self.name!r}, {self.triggers}, fired={self.fired})"
+
+
+class Reflexes(object):
+    """
+    The reflex rules of one robot. Register an instance as a raw stream
+    listener ahead of anything slow, Create2 does this itself.
+    """
+
+    CLIFFS = ('cliff_left', 'cliff_front_left', 'cliff_front_right', 'cliff_right')
+    WHEEL_DROPS = ('bumps_wheeldrops.wheeldrop_left', 'bumps_wheeldrops.wheeldrop_right')
+    BUMPS = ('bumps_wheeldrops.bump_left', 'bumps_wheeldrops.bump_right')
+
+    def __init__(self, sci, motion=None):
+        """
+        sci: the SerialCommandInterface the commands are written to
+        motion: the MotionController to cancel when a reflex writes its command
+        """
+        self.sci = sci
+        self.motion = motion
+        self.rules = ()
+        self.reaction_times = Histogram()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rules)
+
+    def add(self, name, triggers, opcode=OPCODES.DRIVE_DIRECT, data=(0, 0, 0, 0), callback=None, repeat=False):
+        """
+        Adds a rule that fires when any trigger is set.
+
+        name: to find (and remove) the rule by
+        triggers: sensor names, see the module notes
+        opcode, data: the command to write, None for no command
+        callback: optional callback(reflex, timestamp_ns), called in the
+                  reader thread after the command is written
+        repeat: write the command on every frame while the condition holds
+                instead of only when it becomes true, so it wins over
+                commands sent in the meantime (ie, by a DriveScheduler)
+        return: the Reflex
+        """
+        if isinstance(triggers, str):
+            triggers = (triggers,)
+        masks = {}
+        for trigger in triggers:
+            offset, mask = _trigger_mask(trigger)
+            masks[offset] = masks.get(offset, 0) | mask
+
+        reflex = Reflex(name, tuple(triggers), tuple(masks.items()), opcode, data, callback, repeat)
+        with self._lock:
+            if any(r.name == name for r in self.rules):
+                raise Exception(f"A reflex named {name} already exists")
+            self.rules += (reflex,)
+        return reflex
+
+    def remove(self, name):
+        with self._lock:
+            self.rules = tuple(r for r in self.rules if r.name != name)
+
+    def clear(self):
+        with self._lock:
+            self.rules = ()
+
+    def __call__(self, buf, offset, timestamp):
+        """
+        Checks one frame, the signature matches SensorStream.add_raw_listener()
+        """
+        for reflex in self.rules:
+            for o, mask in reflex.masks:
+                if buf[offset + o] & mask:
+                    break
+            else:
+                reflex.triggered = False
+                continue
+
+            if reflex.triggered and not reflex.repeat:
+                continue
+            reflex.triggered = True
+            reflex.fired += 1
+            if reflex.opcode is not None:
+                try:
+                    self.sci.write(reflex.opcode, reflex.data)
+                except Exception as e:
+                    logging.error(f"Reflex {reflex.name} could not write its command: {e}")
+                    continue
+                self.reaction_times.record(time.monotonic_ns() - timestamp)
+                if self.motion is not None and self.motion.active is not None:
+                    self.motion.cancel(f"stopped by reflex {reflex.name}")
+            if reflex.callback is not None:
+                try:
+                    reflex.callback(reflex, timestamp)
+                except Exception:
+                    # the next reflexes (and frames) still have to run
+                    logging.exception(f"Reflex {reflex.name} callback failed")
+
+
+def _trigger_mask(name):
+    """
+    (byte offset in packet 100, mask) of a trigger
+    """
+    field, _, bit = name.partition('.')
+    if field not in _FIELDS:
+        raise Exception(f"Unknown sensor: {field}")
+    offset, fmt = _FIELDS[field]
+    if bit:
+        masks = BITFIELD_MASKS.get(field)
+        if masks is None or bit not in masks:
+            raise Exception(f"Unknown sensor bit: {name}")
+        return offset, masks[bit]
+    if fmt not in ('?', 'B'):
+        raise Exception(f"{name} is not a 1 byte sensor and cannot trigger a reflex")
+    return offset, 0xFF
@@ -1,47 +1,42 @@
-from threading import Timer, Lock
-import time
+from threading import Lock
+from createlib.scheduler import default_scheduler
 
 ####################
-#  Sources:
-#    https://stackoverflow.com/questions/2398661/schedule-a-repeating-event-in-python-3/18942977
-#    https://stackoverflow.com/questions/474528/what-is-the-best-way-to-repeatedly-execute-a-function-every-x-seconds
+#  A job on a PeriodicScheduler (createlib.scheduler). This used to start a
+#  new threading.Timer every interval, which drifted and spawned a thread
+#  per tick, now every RepeatTimer shares one drift free scheduler thread.
 #####################
 class RepeatTimer:
-    """A periodic timer running with threading.Timers."""
+    """A periodic timer running on a PeriodicScheduler."""
 
-    def __init__(self, interval, function, autostart=True):
+    def __init__(self, interval, function, autostart=True, scheduler=None):
+        """
+        scheduler: the PeriodicScheduler to run on, the shared default one if None
+        """
         self._lock = Lock()
         self.function = function
         self.interval = interval
-        self._timer = None
-        self._stopped = True
+        self.scheduler = scheduler
+        self.job = None
         if autostart:
             self.start()
 
-    def start(self, from_run=False):
+    def start(self):
         """
         Starts the timer if it's not already running.
         """
         with self._lock:
-            if not self._stopped and not from_run:
+            if self.job is not None:
                 return
-            self._timer = Timer(self.interval, self._run)
-            self._stopped = False
-            self._timer.start()
-
-    def _run(self):
-        """
-        Executes the function and restarts the timer.
-        """
-        self.start(from_run=True)
-        self.function()
+            if self.scheduler is None:
+                self.scheduler = default_scheduler()
+            self.job = self.scheduler.add(self.interval, self.function)
 
     def stop(self):
         """
         Stops the timer safely.
         """
         with self._lock:
-            if self._timer:
-                self._timer.cancel()
-                self._timer = None
-            self._stopped = True
\ No newline at end of file
+            if self.job is not None:
+                self.job.cancel()
+                self.job = None
@@ -0,0 +1,232 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# Drift free periodic jobs on one thread
+#
+# Every job has an absolute deadline in time.monotonic_ns(); after a run the
+# next deadline is the previous one plus the period, not "now plus the
+# period", so the schedule never drifts. A job that overruns its period
+# skips the ticks it missed and stays in phase instead of running in a
+# burst to catch up.
+#
+#   sched = PeriodicScheduler()
+#   control = sched.add(0.015, control_loop, name='control')   # 66 Hz
+#   sched.add(0.1, log_telemetry, name='telemetry')
+#   sched.start()
+#   ...
+#   control.stats()   # runs, overruns, missed ticks, lateness and run time (us)
+#
+# The thread sleeps until shortly before a deadline and spins for the rest
+# (spin, 200 us by default) because sleeps alone wake up too late for a
+# steady 15 ms loop.
+##############################################
+
+import logging
+import threading
+import time
+from createlib.metrics import Histogram
+
+
+class PeriodicJob(object):
+    """
+    A function run every period by a PeriodicScheduler, see PeriodicScheduler.add()
+
+    Counters:
+        runs:     times the function was called
+        overruns: runs that ended after the next deadline
+        missed:   ticks skipped because of overruns
+        lateness: Histogram of ns between the deadline and the call (jitter)
+        runtime:  Histogram of ns the function took
+    """
+
+    def __init__(self, scheduler, period, function, name):
+        self.scheduler = scheduler
+        self.period = period
+        self.period_ns = int(period * 1e9)
+        self.function = function
+        self.name = name
+        self.deadline = None
+        self.runs = 0
+        self.overruns = 0
+        self.missed = 0
+        self.lateness = Histogram()
+        self.runtime = Histogram()
+
+    @property
+    def active(self):
+        return self.deadline is not None
+
+    def cancel(self):
+        self.scheduler.remove(self)
+
+    def stats(self):
+        """
+        dict of the counters, the histograms are summarized in microseconds
+        """
+        return {
+            'runs': self.runs,
+            'overruns': self.overruns,
+            'missed': self.missed,
+            'lateness_us': self.lateness.summary(1e3),
+            'runtime_us': self.runtime.summary(1e3),
+        }
+
+    def __repr__(self):
+        return f"PeriodicJob({self.name!r}, period={self.period}, runs={self.runs}, overruns={self.overruns})"
+
+
+class PeriodicScheduler(object):
+    """
+    Runs periodic jobs one after another on a single thread.
+    """
+
+    def __init__(self, name='create2-scheduler', spin=0.0002):
+        """
+        name: thread name
+        spin: seconds before a deadline to stop sleeping and busy wait
+        """
+        self.name = name
+        self.spin_ns = int(spin * 1e9)
+        self.jobs = []
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def add(self, period, function, name=None, delay=None):
+        """
+        Schedules function() every period seconds.
+
+        delay: seconds until the first run, one period if None
+        return: the PeriodicJob, pass it to remove() (or call cancel()) to stop it
+        """
+        if period <= 0:
+            raise Exception(f"Invalid period: {period}")
+        job = PeriodicJob(self, period, function, name or getattr(function, '__name__', 'job'))
+        delay_ns = job.period_ns if delay is None else int(delay * 1e9)
+        with self._cond:
+            job.deadline = time.monotonic_ns() + delay_ns
+            self.jobs.append(job)
+            self._cond.notify()
+        return job
+
+    def remove(self, job):
+        """
+        Stops a job. It is not called again once this returns, unless
+        this is called by the job itself while it runs.
+        """
+        with self._cond:
+            job.deadline = None
+            if job in self.jobs:
+                self.jobs.remove(job)
+            self._cond.notify()
+
+    def start(self):
+        """
+        Starts the scheduler thread
+        """
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops the scheduler thread, the jobs stay scheduled for the next start()
+        """
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notify()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def stats(self):
+        """
+        {job name: job stats}
+        """
+        with self._cond:
+            jobs = list(self.jobs)
+        return {job.name: job.stats() for job in jobs}
+
+    def _next(self):
+        """
+        Waits for the earliest deadline and returns (job, deadline), or
+        (None, None) when stopped.
+        """
+        with self._cond:
+            while self._running:
+                if not self.jobs:
+                    self._cond.wait()
+                    continue
+                job = min(self.jobs, key=lambda j: j.deadline)
+                # read under the lock, remove() clears it from other threads
+                deadline = job.deadline
+                wait_ns = deadline - time.monotonic_ns() - self.spin_ns
+                if wait_ns <= 0:
+                    break
+                # jobs added or removed meanwhile notify, so look again after waking
+                self._cond.wait(wait_ns / 1e9)
+            else:
+                return None, None
+
+        while time.monotonic_ns() < deadline:
+            pass
+        return job, deadline
+
+    def _run(self):
+        while True:
+            job, deadline = self._next()
+            if job is None:
+                return
+            if job.deadline != deadline:
+                continue  # removed (or rescheduled) while spinning
+
+            start = time.monotonic_ns()
+            try:
+                job.function()
+            except Exception as e:
+                logging.error(f"Periodic job {job.name} failed: {e}")
+            end = time.monotonic_ns()
+
+            job.runs += 1
+            job.lateness.record(start - deadline)
+            job.runtime.record(end - start)
+
+            with self._cond:
+                if job.deadline is None:
+                    continue  # removed while it ran
+                deadline += job.period_ns
+                if deadline <= end:
+                    # overrun, skip the missed ticks but stay in phase
+                    job.overruns += 1
+                    missed = (end - deadline) // job.period_ns + 1
+                    job.missed += missed
+                    deadline += missed * job.period_ns
+                job.deadline = deadline
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_scheduler():
+    """
+    The shared, already started PeriodicScheduler used by RepeatTimer and
+    DriveScheduler when they are not given one.
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = PeriodicScheduler()
+            _default.start()
+        return _default
@@ -0,0 +1,309 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# Continuous sensor streaming (OI pg 22, opcode 148)
+#
+# Once a stream is requested, the Create 2 sends a frame every 15 ms:
+#   [19][n][id][data ...][checksum]
+# where n is the number of bytes between n and the checksum, and the
+# low byte of the sum of every byte in the frame (checksum included)
+# is 0. A background thread reads these frames and publishes the most
+# recent decoded Sensors snapshot so writers never wait on a read.
+##############################################
+
+import threading
+import logging
+import time
+from createlib.packets import SensorPacketDecoder
+from createlib.create_oi import OPCODES
+
+STREAM_HEADER = 19
+
+
+class StreamFrameParser(object):
+    """
+    Finds single packet stream frames in a ReceiveBuffer.
+
+    parse() works on the buffer in place and returns the offset of the
+    payload, so the caller can unpack_from() it without copying. After
+    a corrupted or dropped byte it resynchronizes on the next header that
+    starts a valid frame, keeping every byte after the bad one.
+
+    Counters:
+        frames:         valid frames returned
+        corrupted:      frames with a good header but a bad checksum
+        misaligned:     header bytes (19) not followed by the frame's length and id
+        skipped_bytes:  bytes discarded while looking for a frame
+        dropped_frames: frames lost, estimated from the skipped bytes
+    """
+
+    def __init__(self, packet_id=100, packet_len=80):
+        self.packet_id = packet_id
+        self.packet_len = packet_len
+        self.frame_len = packet_len + 4  # header, n, id, ..., checksum
+        self.frames = 0
+        self.corrupted = 0
+        self.misaligned = 0
+        self.skipped_bytes = 0
+        self.dropped_frames = 0
+        self._skipped = 0  # since the last valid frame
+
+    @property
+    def bad_frames(self):
+        return self.corrupted + self.misaligned
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'corrupted': self.corrupted,
+            'misaligned': self.misaligned,
+            'skipped_bytes': self.skipped_bytes,
+            'dropped_frames': self.dropped_frames,
+        }
+
+    def _skip(self, rx, num_bytes):
+        self.skipped_bytes += num_bytes
+        self._skipped += num_bytes
+        rx.consume(num_bytes)
+
+    def parse(self, rx):
+        """
+        Consumes the next valid frame in rx and returns the offset of its
+        payload in rx.buf, or -1 if more bytes are needed. The payload stays
+        valid until rx is filled again.
+        """
+        buf = rx.buf
+        length = self.packet_len + 1
+        while True:
+            start = rx.find(STREAM_HEADER)
+            if start < 0:
+                self._skip(rx, rx.tail - rx.head)
+                return -1
+            if start != rx.head:
+                self._skip(rx, start - rx.head)
+
+            # a 19 inside the data is not a header, reject it as soon as its
+            # length and id bytes are in rather than waiting a whole frame for it
+            available = rx.tail - start
+            if ((available > 1 and buf[start + 1] != length)
+                    or (available > 2 and buf[start + 2] != self.packet_id)):
+                self.misaligned += 1
+                self._skip(rx, 1)
+                continue
+            if available < self.frame_len:
+                return -1
+
+            if sum(rx.view[start:start + self.frame_len]) & 0xFF:
+                self.corrupted += 1
+                self._skip(rx, 1)
+                continue
+
+            rx.consume(self.frame_len)
+            self.frames += 1
+            if self._skipped:
+                self.dropped_frames += -(-self._skipped // self.frame_len)
+                self._skipped = 0
+            return start + 3
+
+
+class SensorStream(object):
+    """
+    Reads the packet 100 sensor stream in a background thread.
+
+    The latest Sensors namedtuple is available through `latest`,
+    `wait()` blocks for the next frame and listeners are called from
+    the reader thread with every new snapshot.
+    """
+
+    packet_id = 100
+    packet_len = 80
+
+    def __init__(self, sci):
+        """
+        sci: an open SerialCommandInterface
+        """
+        self.sci = sci
+        self.parser = StreamFrameParser(self.packet_id, self.packet_len)
+        self.decode = SensorPacketDecoder  # replaced by a timed one when metrics are on
+        self.frames = 0
+        self.timestamp = None
+        self._latest = None
+        self._listeners = []
+        self._raw_listeners = []
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self.error = None  # the read error that ended the stream, if one did
+
+    @property
+    def bad_frames(self):
+        return self.parser.bad_frames
+
+    @property
+    def dropped_frames(self):
+        return self.parser.dropped_frames
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def latest(self):
+        """
+        The most recently decoded Sensors namedtuple (None until the first frame)
+        """
+        return self._latest
+
+    def start(self, reader=True):
+        """
+        Asks the robot to stream packet 100 and starts the reader thread.
+
+        reader: False when something else (ie, a Fleet) reads the port and
+                calls process() whenever bytes arrive
+        """
+        if self._running:
+            return
+
+        with self.sci.lock:
+            self.sci.flush()
+            self.sci.write(OPCODES.STREAM, (1, self.packet_id))
+
+        self.error = None
+        self._running = True
+        if reader:
+            self._thread = threading.Thread(target=self._run, name="create2-stream", daemon=True)
+            self._thread.start()
+
+    def pause(self):
+        """
+        Pauses the stream on the robot without tearing down the reader.
+        """
+        self.sci.write(OPCODES.PAUSE_RESUME_STREAM, (0,))
+
+    def resume(self):
+        """
+        Resumes a paused stream.
+        """
+        self.sci.write(OPCODES.PAUSE_RESUME_STREAM, (1,))
+
+    def stop(self):
+        """
+        Halts the stream on the robot and joins the reader thread.
+        """
+        if not self._running:
+            return
+
+        self._running = False
+        if self.sci.ser.is_open:
+            self.pause()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2 * (self.sci.ser.timeout or 1))
+        self._thread = None
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the next frame arrives and returns it, or None on timeout.
+        """
+        with self._cond:
+            frames = self.frames
+            self._cond.wait_for(lambda: self.frames != frames or not self._running, timeout)
+            return self._latest
+
+    def add_listener(self, callback):
+        """
+        Registers callback(sensors) to be called from the reader thread
+        for every frame. Keep callbacks short, they delay the next read.
+        An exception from a callback is logged, the stream goes on.
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def add_raw_listener(self, callback):
+        """
+        Registers callback(buf, offset, timestamp_ns) to be called from the
+        reader thread with the undecoded 80 byte payload at buf[offset:],
+        before the frame is decoded. buf is reused for the next frame, so
+        copy what needs to outlive the call. timestamp_ns is the
+        time.monotonic_ns() when the bytes were read.
+        """
+        self._raw_listeners.append(callback)
+
+    def remove_raw_listener(self, callback):
+        self._raw_listeners.remove(callback)
+
+    # ------------------------ Reader ----------------------------
+
+    def process(self, now=None):
+        """
+        Publishes every complete frame in the receive buffer (sci.rx).
+
+        now: time.monotonic_ns() when the bytes were read
+        return: the number of frames published
+        """
+        if now is None:
+            now = time.monotonic_ns()
+        rx = self.sci.rx
+        parser = self.parser
+        count = 0
+        while True:
+            offset = parser.parse(rx)
+            if offset < 0:
+                return count
+
+            # a failing listener is logged and skipped, it must not stop
+            # the stream (and with it reflexes and motion) for everyone else
+            for callback in tuple(self._raw_listeners):
+                try:
+                    callback(rx.buf, offset, now)
+                except Exception:
+                    logging.exception(f"Sensor stream raw listener {callback!r} failed")
+
+            try:
+                sensors = self.decode(rx.buf, offset)
+            except Exception as e:
+                self.fail(e)
+                return count
+            with self._cond:
+                self._latest = sensors
+                self.timestamp = now / 1e9
+                self.frames += 1
+                self._cond.notify_all()
+
+            for callback in tuple(self._listeners):
+                try:
+                    callback(sensors)
+                except Exception:
+                    logging.exception(f"Sensor stream listener {callback!r} failed")
+            count += 1
+
+    def fail(self, error):
+        """
+        Ends the stream after a read (or decode) error: running turns False,
+        error is kept and wait() returns. The reader thread calls this, and so should
+        whatever reads the port when the stream has no reader (ie, a Fleet).
+        """
+        if self._running:
+            logging.error(f"Sensor stream stopped: {error}")
+        self.error = error
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+
+    def _run(self):
+        while self._running:
+            try:
+                self.sci.fill()
+            except Exception as e:
+                if self._running:
+                    self.fail(e)
+                break
+
+            self.process()
+
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
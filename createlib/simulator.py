@@ -0,0 +1,452 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# Simulated Create 2 for testing without a robot
+#
+# SimulatedCreate2 is the robot side of the Open Interface: it parses the
+# opcodes in OPCODES, tracks the OI mode, integrates the wheel motion from
+# DRIVE / DRIVE_DIRECT / DRIVE_PWM, stores songs and answers SENSORS,
+# QUERY_LIST and STREAM with correctly encoded packets.
+#
+# LoopbackTransport puts it behind the pyserial API, so it plugs straight
+# into Create2:
+#
+#   robot = Create2('sim', transport=LoopbackTransport())
+#
+# Replies only become readable after the time they would take on the wire
+# at the (virtual) baud rate, and the simulation advances lazily from
+# time.monotonic() whenever the transport is used, no thread needed.
+#
+# PtySimulator serves the same robot on a pseudo terminal (POSIX only) for
+# code that opens a port by name, ie, Create2(sim.port).
+##############################################
+
+import math
+import os
+import select
+import threading
+import time
+from collections import deque
+from struct import Struct
+from createlib.create_oi import OPCODES, MODES, ROBOT, BAUD_RATE, COMMAND_ARGUMENTS, VARIABLE_COMMANDS
+from createlib.packets import PACKET_100, PACKET_100_LAYOUT, PACKET_FIELDS, Sensors
+
+_FIELD_STRUCTS = {name: Struct('>' + fmt) for name, _, fmt in PACKET_100_LAYOUT}
+_SHORT = Struct('>h')
+
+STREAM_PERIOD = 0.015
+RESET_BANNER = b'bl-start\r\nSTR730\r\nsimulated Create 2\r\n2007-05-14-1715-L   \r\n'
+
+
+class SimulatedCreate2(object):
+    """
+    The robot side of the Open Interface.
+
+    sensors: raw value of every Sensors field (bitfields as their byte),
+             tests can set bumps, cliffs, light bumper signals, ...
+    """
+
+    def __init__(self, baud=115200):
+        self.baud = baud
+        self.mode = MODES.OFF
+        self.songs = {}
+        self.song_playing_until = 0.0
+        self.leds = (0, 0, 0)
+        self.digits = b'    '
+        self.commands = 0
+
+        # kinematics, mm / mm/s / radians
+        self.x = self.y = self.theta = 0.0
+        self.velocity_left = self.velocity_right = 0
+        self.radius = 0
+        self._travel_left = self._travel_right = 0.0
+        self._distance = self._angle = 0.0
+
+        self.stream_ids = ()
+        self.stream_paused = True
+        self._stream_next = 0.0
+
+        self.sensors = dict.fromkeys(Sensors._fields, 0)
+        self.sensors.update(voltage=16000, current=-150, temperature=25,
+                            battery_charge=2500, battery_capacity=2696)
+
+        self.output = deque()  # (time, bytes) replies waiting for the transport
+        self._input = bytearray()
+        self._now = None
+
+    # ------------------------ Time ----------------------------
+
+    def advance(self, now):
+        """
+        Moves the simulation forward to `now` (time.monotonic()), emitting
+        any stream frames that came due on the way.
+        """
+        if self._now is None:
+            self._now = now
+        if not self.stream_paused and self.stream_ids:
+            if now - self._stream_next > 1.0:
+                # nobody has looked in a long time, don't flood them
+                self._stream_next = now
+            while self._stream_next <= now:
+                self._integrate(self._stream_next)
+                self.output.append((self._stream_next, self._stream_frame()))
+                self._stream_next += STREAM_PERIOD
+        self._integrate(now)
+
+    def next_event(self):
+        """
+        Time of the next stream frame, or None
+        """
+        if not self.stream_paused and self.stream_ids:
+            return self._stream_next
+        return None
+
+    def _integrate(self, now):
+        dt = now - self._now
+        if dt <= 0:
+            return
+        self._now = now
+
+        dl = self.velocity_left * dt
+        dr = self.velocity_right * dt
+        d = (dl + dr) / 2
+        dtheta = (dr - dl) / ROBOT.WHEEL_BASE
+        heading = self.theta + dtheta / 2
+        self.x += d * math.cos(heading)
+        self.y += d * math.sin(heading)
+        self.theta = (self.theta + dtheta + math.pi) % (2 * math.pi) - math.pi
+
+        self._travel_left += dl
+        self._travel_right += dr
+        self._distance += d
+        self._angle += math.degrees(dtheta)
+
+    # ------------------------ Commands ----------------------------
+
+    def receive(self, data, now):
+        """
+        Feeds bytes sent by the host, complete commands are executed.
+        """
+        self.advance(now)
+        self._input += data
+        buf = self._input
+        while buf:
+            opcode = buf[0]
+            if opcode in COMMAND_ARGUMENTS:
+                size = 1 + COMMAND_ARGUMENTS[opcode]
+            elif opcode in VARIABLE_COMMANDS:
+                before, per_item = VARIABLE_COMMANDS[opcode]
+                if len(buf) < 1 + before:
+                    return
+                size = 1 + before + buf[before] * per_item
+            else:
+                # not an opcode we know (or garbage), skip it like the robot would
+                del buf[:1]
+                continue
+
+            if len(buf) < size:
+                return
+            args = bytes(buf[1:size])
+            del buf[:size]
+            self.commands += 1
+            self._execute(OPCODES(opcode), args, now)
+
+    def _execute(self, opcode, args, now):
+        if opcode == OPCODES.START:
+            self.mode = MODES.PASSIVE
+            return
+        if self.mode == MODES.OFF:
+            return  # the OI ignores everything but START when off
+
+        if opcode == OPCODES.STOP:
+            self._halt()
+            self.stream_paused = True
+            self.mode = MODES.OFF
+        elif opcode == OPCODES.RESET:
+            self._halt()
+            self.stream_paused = True
+            self.mode = MODES.OFF
+            self.output.append((now, RESET_BANNER))
+        elif opcode == OPCODES.BAUD:
+            self.baud = baud_rate(args[0])
+        elif opcode == OPCODES.SAFE:
+            self.mode = MODES.SAFE
+        elif opcode == OPCODES.FULL:
+            self.mode = MODES.FULL
+        elif opcode in (OPCODES.POWER, OPCODES.CLEAN, OPCODES.MAX, OPCODES.SPOT, OPCODES.SEEK_DOCK):
+            self._halt()
+            self.mode = MODES.PASSIVE
+        elif opcode == OPCODES.SONG:
+            song_num = args[0]
+            self.songs[song_num] = args[2:]
+        elif opcode == OPCODES.PLAY:
+            self._play(args[0], now)
+        elif opcode == OPCODES.SENSORS:
+            self.output.append((now, self._packet(args[0])))
+        elif opcode == OPCODES.QUERY_LIST:
+            self.output.append((now, b''.join(self._packet(pid) for pid in args[1:])))
+        elif opcode == OPCODES.STREAM:
+            self.stream_ids = tuple(args[1:])
+            self.stream_paused = False
+            self._stream_next = now + STREAM_PERIOD
+        elif opcode == OPCODES.PAUSE_RESUME_STREAM:
+            self.stream_paused = not args[0]
+            if args[0]:
+                self._stream_next = now + STREAM_PERIOD
+        elif self.mode in (MODES.SAFE, MODES.FULL):
+            self._actuate(opcode, args)
+
+    def _actuate(self, opcode, args):
+        if opcode == OPCODES.DRIVE_DIRECT:
+            r, l = Struct('>2h').unpack(args)
+            self.velocity_right, self.velocity_left = _clamp(r, 500), _clamp(l, 500)
+            self.radius = 0
+        elif opcode == OPCODES.DRIVE_PWM:
+            r, l = Struct('>2h').unpack(args)
+            self.velocity_right = round(_clamp(r, 255) * 500 / 255)
+            self.velocity_left = round(_clamp(l, 255) * 500 / 255)
+            self.radius = 0
+        elif opcode == OPCODES.DRIVE:
+            v, radius = Struct('>hh').unpack(args)
+            v = _clamp(v, 500)
+            self.radius = radius
+            if radius in (-0x8000, 0x7FFF):
+                self.velocity_left = self.velocity_right = v
+            elif radius == -1:
+                self.velocity_left, self.velocity_right = v, -v
+            elif radius == 1:
+                self.velocity_left, self.velocity_right = -v, v
+            else:
+                half = ROBOT.WHEEL_BASE / 2
+                self.velocity_left = round(v * (radius - half) / radius)
+                self.velocity_right = round(v * (radius + half) / radius)
+        elif opcode == OPCODES.LED:
+            self.leds = tuple(args)
+        elif opcode == OPCODES.DIGIT_LED_ASCII:
+            self.digits = args
+
+    def _halt(self):
+        self.velocity_left = self.velocity_right = 0
+        self.radius = 0
+
+    def _play(self, song_num, now):
+        notes = self.songs.get(song_num)
+        if notes is None:
+            return
+        self.sensors['song_number'] = song_num
+        self.song_playing_until = now + sum(notes[1::2]) / 64
+
+    # ------------------------ Sensors ----------------------------
+
+    def _update_sensors(self):
+        s = self.sensors
+        s['open_interface_mode'] = int(self.mode)
+        s['song_playing'] = self._now < self.song_playing_until
+        s['oi_stream_num_packets'] = len(self.stream_ids)
+        s['velocity'] = round((self.velocity_left + self.velocity_right) / 2)
+        s['radius'] = self.radius
+        s['velocity_right'] = self.velocity_right
+        s['velocity_left'] = self.velocity_left
+        s['encoder_counts_left'] = int(self._travel_left / ROBOT.TICK_TO_DISTANCE) & 0xFFFF
+        s['encoder_counts_right'] = int(self._travel_right / ROBOT.TICK_TO_DISTANCE) & 0xFFFF
+        s['distance'] = _clamp(int(self._distance), 32767)
+        s['angle'] = _clamp(int(self._angle), 32767)
+
+    def _reset_odometers(self):
+        # distance and angle restart from 0 each time they are read (OI pg 27)
+        self._distance -= int(self._distance)
+        self._angle -= int(self._angle)
+
+    def _packet(self, packet_id):
+        """
+        Encodes one sensor packet, b'' for ids the simulator doesn't know
+        """
+        self._update_sensors()
+        if packet_id == 100:
+            data = PACKET_100.pack(*[self.sensors[name] for name in Sensors._fields])
+            self._reset_odometers()
+            return data
+
+        name = PACKET_FIELDS.get(packet_id)
+        if name is None:
+            return b''
+        if name in ('distance', 'angle'):
+            value = self.sensors[name]
+            if name == 'distance':
+                self._distance -= value
+            else:
+                self._angle -= value
+            return _SHORT.pack(value)
+        return _FIELD_STRUCTS[name].pack(self.sensors[name])
+
+    def _stream_frame(self):
+        body = bytearray()
+        for pid in self.stream_ids:
+            body.append(pid)
+            body += self._packet(pid)
+        frame = bytearray((19, len(body))) + body
+        frame.append(-sum(frame) & 0xFF)
+        return bytes(frame)
+
+
+class LoopbackTransport(object):
+    """
+    pyserial compatible transport connected to a SimulatedCreate2.
+
+    robot: the SimulatedCreate2 on the other end (a new one if None)
+    """
+
+    def __init__(self, robot=None, port='loop://create2'):
+        self.robot = robot if robot is not None else SimulatedCreate2()
+        self.port = port
+        self.baudrate = 115200
+        self.timeout = None
+        self.is_open = False
+        self.rts = True
+        self.dtr = True
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self._rx = bytearray()
+        self._pending = deque()  # (time readable, bytes)
+        self._line_free = 0.0
+        self._cond = threading.Condition()
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        with self._cond:
+            self.is_open = False
+            self._cond.notify_all()
+
+    def write(self, data):
+        if not self.is_open:
+            raise Exception("Port is not open")
+        data = bytes(data)
+        with self._cond:
+            now = time.monotonic()
+            # at the wrong baud rate the robot only sees noise
+            if self.baudrate == self.robot.baud:
+                self.robot.receive(data, now)
+            self.bytes_written += len(data)
+            self._collect(now)
+            self._cond.notify_all()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    @property
+    def in_waiting(self):
+        with self._cond:
+            self._collect(time.monotonic())
+            return len(self._rx)
+
+    def read(self, size=1):
+        """
+        Blocks until size bytes are readable or the timeout expires
+        """
+        with self._cond:
+            deadline = None if self.timeout is None else time.monotonic() + self.timeout
+            while self.is_open:
+                now = time.monotonic()
+                self._collect(now)
+                if len(self._rx) >= size:
+                    break
+                wake = deadline
+                for t in (self._pending[0][0] if self._pending else None, self.robot.next_event()):
+                    if t is not None and (wake is None or t < wake):
+                        wake = t
+                if deadline is not None and now >= deadline:
+                    break
+                self._cond.wait(None if wake is None else max(wake - now, 0))
+
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+            self.bytes_read += len(data)
+            return data
+
+    def flushInput(self):
+        with self._cond:
+            self._collect(time.monotonic())
+            self._rx.clear()
+
+    reset_input_buffer = flushInput
+
+    def _collect(self, now):
+        """
+        Moves the robot's replies onto the virtual wire and everything that
+        has finished arriving into the receive buffer.
+        """
+        robot = self.robot
+        robot.advance(now)
+        byte_time = 10 / robot.baud  # start + 8 data + stop bits
+        while robot.output:
+            t, data = robot.output.popleft()
+            if self.baudrate != robot.baud:
+                continue
+            start = max(t, self._line_free)
+            self._line_free = start + len(data) * byte_time
+            self._pending.append((self._line_free, data))
+
+        while self._pending and self._pending[0][0] <= now:
+            self._rx += self._pending.popleft()[1]
+
+
+class PtySimulator(object):
+    """
+    Runs a SimulatedCreate2 behind a pseudo terminal in a background thread.
+    The pty delivers bytes as fast as the host reads them, there is no
+    virtual baud rate here.
+
+        sim = PtySimulator()
+        robot = Create2(sim.port)
+        ...
+        sim.close()
+    """
+
+    def __init__(self, robot=None):
+        import tty
+        self.robot = robot if robot is not None else SimulatedCreate2()
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="create2-pty-sim", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        robot = self.robot
+        while self._running:
+            now = time.monotonic()
+            due = robot.next_event()
+            timeout = 0.1 if due is None else min(max(due - now, 0), 0.1)
+            try:
+                ready, _, _ = select.select([self._master], [], [], timeout)
+                now = time.monotonic()
+                if ready:
+                    robot.receive(os.read(self._master, 4096), now)
+                robot.advance(now)
+                while robot.output:
+                    os.write(self._master, robot.output.popleft()[1])
+            except OSError:
+                break
+
+    def close(self):
+        self._running = False
+        self._thread.join(timeout=1)
+        os.close(self._master)
+        os.close(self._slave)
+
+
+def baud_rate(code):
+    """
+    Bits per second of a BAUD_RATE code
+    """
+    return BAUD_RATE(code).bps
+
+
+def _clamp(value, limit):
+    return max(-limit, min(limit, value))
@@ -0,0 +1,240 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2021 Nick Stiffler
+# see LICENSE for full details
+##############################################
+# Binary telemetry recording and memory mapped replay
+#
+# File layout (little endian):
+#   header: 8s magic 'C2TELEM\0', H version, H payload length, 4x
+#   record: q time.monotonic_ns(), payload (packet 100, 80 bytes)
+#
+# Records have a fixed size, so record i is at HEADER.size + i * RECORD_SIZE and a
+# reader never has to scan the file. Recording while streaming:
+#
+#   recorder = TelemetryRecorder('run.c2t')
+#   robot.start_stream().add_raw_listener(recorder.record)
+##############################################
+
+import bisect
+import mmap
+import os
+import time
+from struct import Struct
+from createlib.packets import SensorSnapshot, Sensors
+
+MAGIC = b'C2TELEM\0'
+VERSION = 1
+HEADER = Struct('<8sHH4x')
+TIMESTAMP = Struct('<q')
+PAYLOAD_LEN = 80
+RECORD_SIZE = TIMESTAMP.size + PAYLOAD_LEN
+
+
+class TelemetryRecorder(object):
+    """
+    Appends raw sensor frames with a monotonic timestamp to a file.
+    """
+
+    def __init__(self, path):
+        """
+        path: file to create, or to append to
+        """
+        self.path = path
+        self.records = 0
+        self._record = bytearray(RECORD_SIZE)
+        self._view = memoryview(self._record)
+
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER.size:
+            with open(path, 'rb') as f:
+                _read_header(f.read(HEADER.size))
+            self._file = open(path, 'ab')
+            # drop a partial record left by a crash so the records stay aligned
+            extra = (os.path.getsize(path) - HEADER.size) % RECORD_SIZE
+            if extra:
+                self._file.truncate(os.path.getsize(path) - extra)
+        else:
+            self._file = open(path, 'wb')
+            self._file.write(HEADER.pack(MAGIC, VERSION, PAYLOAD_LEN))
+
+    def record(self, data, offset=0, timestamp=None):
+        """
+        Appends one frame. The signature matches SensorStream.add_raw_listener().
+
+        data: a buffer holding the payload at data[offset:]
+        timestamp: time.monotonic_ns(), now if None
+        """
+        if timestamp is None:
+            timestamp = time.monotonic_ns()
+        TIMESTAMP.pack_into(self._record, 0, timestamp)
+        self._view[TIMESTAMP.size:] = memoryview(data)[offset:offset + PAYLOAD_LEN]
+        self._file.write(self._record)
+        self.records += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TelemetryFrame(object):
+    """
+    One recorded frame. Sensors fields are decoded one by one when they
+    are first accessed, see SensorSnapshot.
+    """
+
+    __slots__ = ('index', 'timestamp', '_buf', '_offset', '_sensors')
+
+    def __init__(self, index, timestamp, buf, offset):
+        self.index = index
+        self.timestamp = timestamp
+        self._buf = buf
+        self._offset = offset
+        self._sensors = None
+
+    @property
+    def raw(self):
+        """ The payload bytes """
+        return bytes(self._buf[self._offset:self._offset + PAYLOAD_LEN])
+
+    @property
+    def sensors(self):
+        if self._sensors is None:
+            self._sensors = SensorSnapshot(self._buf, self._offset)
+        return self._sensors
+
+    def __getattr__(self, name):
+        if name in Sensors._fields:
+            return getattr(self.sensors, name)
+        raise AttributeError(name)
+
+    def __repr__(self):
+        return f"TelemetryFrame(index={self.index}, timestamp={self.timestamp})"
+
+
+class _Timestamps(object):
+    """ Sequence view of the record timestamps for bisect """
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __len__(self):
+        return len(self.reader)
+
+    def __getitem__(self, i):
+        return self.reader.timestamp(i)
+
+
+class TelemetryReader(object):
+    """
+    Random access to a recording through a read only memory map. Opening
+    costs the same for any file size and frames are read on demand.
+
+        with TelemetryReader('run.c2t') as log:
+            print(len(log), log[-1].distance)
+            for frame in log.between(t0, t1):
+                ...
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        _read_header(self._mm[:HEADER.size])
+        # a partial record at the end (still being written) is ignored
+        self._count = (len(self._mm) - HEADER.size) // RECORD_SIZE
+
+    def __len__(self):
+        return self._count
+
+    def _offset(self, i):
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError('telemetry frame index out of range')
+        return i, HEADER.size + i * RECORD_SIZE
+
+    def timestamp(self, i):
+        """ The time.monotonic_ns() timestamp of frame i """
+        i, offset = self._offset(i)
+        return TIMESTAMP.unpack_from(self._mm, offset)[0]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._count))]
+        i, offset = self._offset(i)
+        return TelemetryFrame(i, TIMESTAMP.unpack_from(self._mm, offset)[0],
+                              self._mm, offset + TIMESTAMP.size)
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    def index_at(self, timestamp):
+        """
+        Index of the last frame recorded at or before timestamp (ns), or
+        -1 if the recording starts later.
+        """
+        return bisect.bisect_right(_Timestamps(self), timestamp) - 1
+
+    def at(self, timestamp):
+        """
+        The frame that was current at timestamp (ns)
+        """
+        i = self.index_at(timestamp)
+        if i < 0:
+            raise IndexError(f"No frame recorded at or before {timestamp}")
+        return self[i]
+
+    def between(self, start, end):
+        """
+        Iterates over the frames with start <= timestamp < end (ns)
+        """
+        timestamps = _Timestamps(self)
+        first = bisect.bisect_left(timestamps, start)
+        last = bisect.bisect_left(timestamps, end)
+        for i in range(first, last):
+            yield self[i]
+
+    def to_numpy(self):
+        """
+        Every frame as a NumPy structured array, see createlib.columnar
+        """
+        from createlib.columnar import telemetry_to_array
+        return telemetry_to_array(self)
+
+    def to_columns(self):
+        """
+        Every frame as a dict of NumPy column arrays, see createlib.columnar
+        """
+        from createlib.columnar import to_columns
+        return to_columns(self.to_numpy())
+
+    def close(self):
+        # frames handed out keep a reference to the map, let them finish with it
+        self._mm = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _read_header(data):
+    magic, version, length = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise Exception("Not a Create 2 telemetry file")
+    if version != VERSION:
+        raise Exception(f"Unsupported telemetry file version: {version}")
+    if length != PAYLOAD_LEN:
+        raise Exception(f"Telemetry file holds {length} byte frames, not {PAYLOAD_LEN}")